@@ -0,0 +1,54 @@
+# Lines/sec of StatesMonitor reading the same trace plain and compressed (gzip, xz), with the decompression on
+# the reading thread or on a background thread (see compressed.py).
+import gzip
+import lzma
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import compressed
+from bench_parser import write_trace
+from testing import StatesMonitor
+
+N_LINES = 1000000
+
+
+class UnthreadedMonitor(StatesMonitor):
+    def open(self, path):
+        return compressed.open_trace(path, threaded=False)
+
+
+def bench(monitor_class, path):
+    start = time.perf_counter()
+    mon = monitor_class(path)
+    events = 0
+    while not mon.finished:
+        mon.advance()
+        events += 1
+    mon.in_stream.close()
+    return events, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "trace.txt")
+        write_trace(path, N_LINES, multival=False)
+        with open(path, "rb") as f:
+            data = f.read()
+        with gzip.open(path + ".gz", "wb") as f:
+            f.write(data)
+        with lzma.open(path + ".xz", "wb") as f:
+            f.write(data)
+
+        events, t_plain = bench(StatesMonitor, path)
+        print("%8s %10s %18s %18s" % ("format", "MB", "same thread (l/s)", "background (l/s)"))
+        print("%8s %10.1f %18.0f %18s" % ("plain", len(data) / 1e6, N_LINES / t_plain, "-"))
+        for ext in (".gz", ".xz"):
+            events_same, t_same = bench(UnthreadedMonitor, path + ext)
+            events_thread, t_thread = bench(StatesMonitor, path + ext)
+            assert events_same == events_thread == events
+            print("%8s %10.1f %18.0f %18.0f" % (ext, os.path.getsize(path + ext) / 1e6, N_LINES / t_same,
+                                                 N_LINES / t_thread))
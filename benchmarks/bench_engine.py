@@ -0,0 +1,105 @@
+# Throughput of MetamorphicTestingHandler.run_test_case on synthetic traces (see tracegen.py), with function
+# relations and with file relations. Every case runs in a new interpreter, to measure its startup (import) time
+# and peak memory. Usage: python bench_engine.py [--events N] [--json results.json]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+# name, ports, density, multival
+CASES = [("dense", 10, 1.0, False),
+         ("sparse", 10, 0.05, False),
+         ("many-ports", 100, 0.05, False),
+         ("multival", 10, 0.2, True)]
+MODES = ("func", "file")
+
+
+def make_relation(in_port, out_port):
+    def relation(inputs, outputs):
+        if inputs[in_port].curr_state == 1:
+            assert outputs[out_port].curr_state != 2
+    return relation
+
+
+def run_case(folder, mode, multival):
+    # Runs in the child process: prints the measures as JSON
+    start = time.perf_counter()
+    from testing import MetamorphicTestingHandler
+    startup = time.perf_counter() - start
+
+    with open(os.path.join(folder, "ports.json")) as f:
+        ports = json.load(f)
+    inputs, outputs = ports["inputs"], ports["outputs"]
+
+    relations = None
+    rules_path = None
+    if mode == "func":
+        in_ports, out_ports = list(inputs), list(outputs)
+        relations = {"rel_%d" % i: make_relation(in_ports[i % len(in_ports)], out_ports[i % len(out_ports)])
+                     for i in range(max(len(in_ports), len(out_ports)))}
+    else:
+        rules_path = os.path.join(folder, "rules.txt")
+
+    handler = MetamorphicTestingHandler(inputs, outputs, multival=multival, verbose=False, profile=True)
+    start = time.perf_counter()
+    handler.run_test_case("bench", folder, folder, relations, rules_path)
+    elapsed = time.perf_counter() - start
+
+    run = handler.profiler.runs[-1]
+    print(json.dumps({"startup": startup, "elapsed": elapsed, "steps": run["steps"], "events": run["events"],
+                      "parse_time": sum(run["parse_time"].values()), "peak_mb": peak_memory_mb()}))
+
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def bench(n_events):
+    from tracegen import generate_test_case
+
+    results = []
+    print("%-12s %6s %6s %9s %12s %10s %10s %12s" % ("case", "mode", "ports", "steps", "events/s", "parse (s)",
+                                                      "peak (MB)", "startup (ms)"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, n_ports, density, multival in CASES:
+            folder = os.path.join(tmp_dir, name)
+            generate_test_case(folder, n_ports, n_events, density, multival=multival)
+
+            for mode in MODES:
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", folder, mode] +
+                                     (["--multival"] if multival else []),
+                                     check=True, capture_output=True, text=True).stdout
+                result = dict(json.loads(out.strip().splitlines()[-1]), case=name, mode=mode, ports=n_ports)
+                results.append(result)
+                print("%-12s %6s %6d %9d %12.0f %10.3f %10.1f %12.1f" % (
+                    name, mode, n_ports, result["steps"], result["events"] / result["elapsed"], result["parse_time"],
+                    result["peak_mb"] or 0, 1e3 * result["startup"]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the testing engine on synthetic traces.")
+    parser.add_argument("--events", type=int, default=20000, help="lines per port file")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--run", nargs=2, metavar=("FOLDER", "MODE"), help=argparse.SUPPRESS)
+    parser.add_argument("--multival", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_case(args.run[0], args.run[1], args.multival)
+    else:
+        results = bench(args.events)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,44 @@
+# Startup time of the testing core: time to import each module in a new interpreter (minus the time of an
+# empty interpreter), and whether it loads any plotting dependency.
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODULES = ("testing", "trace_cache", "campaign", "cross_run", "socket_source", "visualization")
+PLOTTING = ("matplotlib", "PIL")
+REPEAT = 5
+
+CHILD = """
+import sys, time
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(__import__("json").dumps([elapsed, [m for m in %r if m in sys.modules]]))
+"""
+
+
+def run(code):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return time.perf_counter() - start, out
+
+
+def bench(module):
+    # Best of REPEAT runs, as the first ones also pay for the disk cache
+    results = [run(CHILD % (module, PLOTTING)) for _ in range(REPEAT)]
+    process_time, out = min(results, key=lambda result: result[0])
+    import_time, plotting = json.loads(out)
+    return process_time, import_time, plotting
+
+
+if __name__ == "__main__":
+    baseline = min(run("pass")[0] for _ in range(REPEAT))
+    print("%-14s %12s %12s  %s" % ("module", "import (ms)", "startup (ms)", "plotting modules loaded"))
+    for module in MODULES:
+        process_time, import_time, plotting = bench(module)
+        print("%-14s %12.1f %12.1f  %s" % (module, 1e3 * import_time, 1e3 * (process_time - baseline),
+                                           ", ".join(plotting) or "-"))
@@ -0,0 +1,61 @@
+# Seconds of a window near the end of a test case with run_test_case, reading the port files from the start and
+# seeking with time indexes (see time_index.py). Also checks that windows check the steps of a full run, including
+# when a malformed line ends a port before the end of its file.
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_parser import write_trace
+from tracegen import format_time
+from testing import MetamorphicTestingHandler
+
+N_LINES = 1000000
+WINDOW = 10000  # ms
+
+
+def run_window(handler, tc_id, path, t_start=None, t_end=None):
+    start = time.perf_counter()
+    handler.run_test_case(tc_id, path, path, None, None, t_start=t_start, t_end=t_end)
+    return list(handler.port_values[tc_id]), time.perf_counter() - start
+
+
+def check_port_end(tmp_dir, n_lines=20000):
+    # Port a ends at the blank line in the middle of its file (past several index entries), so no step comes after
+    # it even though the file goes on
+    path = os.path.join(tmp_dir, "port_end")
+    os.makedirs(path)
+    with open(os.path.join(path, "a.txt"), "w") as f:
+        for t in range(n_lines):
+            f.write("%s%s 1\n" % ("\n" if t == n_lines // 2 else "", format_time(t)))
+    with open(os.path.join(path, "b.txt"), "w") as f:
+        f.writelines("%s 1\n" % format_time(t) for t in range(n_lines))
+
+    for time_index in (False, True):
+        # With time_index=True the full run builds the indexes that the windows seek with
+        handler = MetamorphicTestingHandler({"a": "a.txt"}, {"b": "b.txt"}, verbose=False, time_index=time_index)
+        steps, _ = run_window(handler, "full", path)
+        assert steps == list(range(n_lines // 2)), steps[-1]
+        for t_start in (n_lines // 4, 3 * n_lines // 4):
+            window, _ = run_window(handler, "window_%d" % t_start, path, t_start)
+            assert window == [t for t in steps if t >= t_start], (time_index, t_start, window[:1], len(window))
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        check_port_end(tmp_dir)
+
+        for name in ("a", "b"):
+            write_trace(os.path.join(tmp_dir, name + ".txt"), N_LINES, multival=False, seed=ord(name))
+        handler = MetamorphicTestingHandler({"a": "a.txt"}, {"b": "b.txt"}, verbose=False, time_index=True)
+        steps, t_full = run_window(handler, "full", tmp_dir)
+        t_start = steps[-1] - WINDOW
+        window_scan, t_scan = run_window(MetamorphicTestingHandler({"a": "a.txt"}, {"b": "b.txt"}, verbose=False),
+                                         "scan", tmp_dir, t_start)
+        window_seek, t_seek = run_window(handler, "seek", tmp_dir, t_start)
+        assert window_scan == window_seek == [t for t in steps if t >= t_start]
+        print("%10s %10s %12s %12s" % ("steps", "window", "scan (s)", "seek (s)"))
+        print("%10d %10d %12.3f %12.3f (full run with index build: %.3f s)" % (len(steps), len(window_seek), t_scan,
+                                                                            t_seek, t_full))
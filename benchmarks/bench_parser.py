@@ -0,0 +1,59 @@
+# Compares the lines/sec of the bulk parser of StatesMonitor with the previous per-line regex path
+# (readline + parse_state), for single and multival traces.
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from testing import StatesMonitor
+
+N_LINES = 500000
+
+
+def write_trace(path, n_lines, multival, seed=0):
+    rnd = random.Random(seed)
+    t = 0
+    with open(path, "w") as f:
+        for i in range(n_lines):
+            t += rnd.randint(1, 500)
+            hours, rest = divmod(t, 3600000)
+            minutes, rest = divmod(rest, 60000)
+            seconds, millis = divmod(rest, 1000)
+            value = "%d %d" % (rnd.randint(0, 9), rnd.randint(0, 99999)) if multival else rnd.choice(["0", "1", "3.4"])
+            f.write("%02d:%02d:%02d:%03d %s\n" % (hours % 100, minutes, seconds, millis, value))
+
+
+class RegexMonitor(StatesMonitor):
+    # Previous implementation: one readline() and one re.match per line
+    def read_block(self):
+        line = self.in_stream.readline()
+        return self.parse_state(line.strip()) if line else None
+
+
+def bench(monitor_class, path, multival):
+    start = time.perf_counter()
+    mon = monitor_class(path, multival=multival)
+    events = 0
+    while not mon.finished:
+        mon.advance()
+        events += 1
+    mon.in_stream.close()
+    return events, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print("%10s %10s %16s %16s %8s" % ("format", "lines", "regex (lines/s)", "bulk (lines/s)", "speedup"))
+        for multival in (False, True):
+            path = os.path.join(tmp_dir, "trace.txt")
+            write_trace(path, N_LINES, multival)
+
+            events_regex, t_regex = bench(RegexMonitor, path, multival)
+            events_bulk, t_bulk = bench(StatesMonitor, path, multival)
+            assert events_regex == events_bulk
+
+            print("%10s %10d %16.0f %16.0f %7.1fx" % ("multival" if multival else "single", N_LINES,
+                                                     N_LINES / t_regex, N_LINES / t_bulk, t_regex / t_bulk))
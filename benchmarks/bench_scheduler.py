@@ -0,0 +1,87 @@
+# Compares the heap-based EventScheduler with the previous linear scan over all the monitors
+# for an increasing number of ports. Only the event loop is measured (no parsing, no relations).
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from testing import EventScheduler
+
+EVENTS_PER_PORT = 50
+TIME_RANGE = 10 ** 7  # Sparse events: few ports change at each step
+PORT_COUNTS = (10, 100, 500, 1000)
+
+
+class ListMonitor:
+    # Minimal in-memory stand-in for StatesMonitor
+    def __init__(self, times):
+        self.times = times
+        self.pos = -1
+        self.curr_time = None
+        self.next_time = times[0] if times else None
+        self.finished = not times
+
+    def advance(self):
+        self.pos += 1
+        self.curr_time = self.next_time
+        self.next_time = self.times[self.pos + 1] if self.pos + 1 < len(self.times) else None
+        self.finished = self.next_time is None
+
+
+def make_monitors(n_ports, seed=0):
+    rnd = random.Random(seed)
+    monitors = {}
+    for i in range(n_ports):
+        times = sorted(rnd.sample(range(TIME_RANGE), EVENTS_PER_PORT))
+        monitors["p%d" % i] = ListMonitor(times)
+    return monitors
+
+
+def run_linear(inputs, outputs):
+    steps = 0
+    while True:
+        try:
+            min_in = min(mon.next_time for mon in inputs.values() if mon.next_time is not None)
+            min_out = min(mon.next_time for mon in outputs.values() if mon.next_time is not None)
+            sim_time = min(min_in, min_out)
+        except ValueError:
+            return steps
+
+        for monitors in (inputs, outputs):
+            for mon in monitors.values():
+                if mon.next_time == sim_time:
+                    mon.advance()
+        steps += 1
+
+
+def run_heap(inputs, outputs):
+    steps = 0
+    scheduler = EventScheduler(inputs, outputs)
+    sim_time = scheduler.next_time()
+    while sim_time is not None:
+        scheduler.advance(sim_time)
+        sim_time = scheduler.next_time()
+        steps += 1
+    return steps
+
+
+def bench(run, n_ports):
+    monitors = make_monitors(n_ports)
+    names = list(monitors)
+    inputs = {k: monitors[k] for k in names[:n_ports // 2]}
+    outputs = {k: monitors[k] for k in names[n_ports // 2:]}
+
+    start = time.perf_counter()
+    steps = run(inputs, outputs)
+    return steps, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    print("%8s %8s %12s %12s %8s" % ("ports", "steps", "linear (s)", "heap (s)", "speedup"))
+    for n_ports in PORT_COUNTS:
+        steps_lin, t_lin = bench(run_linear, n_ports)
+        steps_heap, t_heap = bench(run_heap, n_ports)
+        assert steps_lin == steps_heap
+        print("%8d %8d %12.3f %12.3f %7.1fx" % (n_ports, steps_heap, t_lin, t_heap, t_lin / t_heap))
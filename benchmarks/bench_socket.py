@@ -0,0 +1,58 @@
+# Compares checking a test case from its port files with receiving the same events over a local socket
+# from the stand-in simulator in socket_source.py (replay). No relations are checked, only the event loop.
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_parser import write_trace
+from socket_source import SocketEventSource, replay
+from testing import MetamorphicTestingHandler
+
+N_PORTS = 10
+N_LINES = 20000  # Per port
+ADDRESS = ("127.0.0.1", 8765)
+
+
+def run_files(handler, path):
+    handler.run_test_case("files", path, path, None, None)
+
+
+def run_socket(handler, path):
+    port_files = {("in", port): os.path.join(path, name) for port, name in handler.input_filenames.items()}
+    port_files.update({("out", port): os.path.join(path, name) for port, name in handler.output_filenames.items()})
+    with SocketEventSource(ADDRESS) as source:
+        simulator = threading.Thread(target=lambda: asyncio.run(replay(ADDRESS, port_files)))
+        simulator.start()
+        handler.run_test_case_stream("socket", source, None, None)
+        simulator.join()
+
+
+def bench(run, handler, path):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run(handler, path)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        names = ["p%d.txt" % i for i in range(N_PORTS)]
+        for i, name in enumerate(names):
+            write_trace(os.path.join(tmp_dir, name), N_LINES, False, seed=i)
+
+        handler = MetamorphicTestingHandler({name: name for name in names[:N_PORTS // 2]},
+                                            {name: name for name in names[N_PORTS // 2:]})
+        t_files = bench(run_files, handler, tmp_dir)
+        t_socket = bench(run_socket, handler, tmp_dir)
+        steps = len(handler.port_values["files"])
+        assert steps == len(handler.port_values["socket"])
+
+        print("%8s %8s %14s %14s" % ("ports", "steps", "files (ev/s)", "socket (ev/s)"))
+        print("%8d %8d %14.0f %14.0f" % (N_PORTS, steps, steps / t_files, steps / t_socket))
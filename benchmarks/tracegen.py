@@ -0,0 +1,86 @@
+# Synthetic test cases in the port file format ("HH:MM:SS[:mmm] value" per line), to measure the testing engine
+# on traces of any size. Usage: python tracegen.py <folder> [--ports 10] [--events 100000] [--density 0.2] ...
+import argparse
+import json
+import os
+import random
+
+TICK = 10  # ms between the steps of the synthetic simulation
+
+
+def format_time(sim_time, millis=True):
+    hours, rest = divmod(sim_time, 3600000)
+    minutes, rest = divmod(rest, 60000)
+    seconds, ms = divmod(rest, 1000)
+    if millis:
+        return "%02d:%02d:%02d:%03d" % (hours, minutes, seconds, ms)
+    return "%02d:%02d:%02d" % (hours, minutes, seconds)
+
+
+def port_values(rnd, n_events, density, change, multival, fields=2):
+    """Generator of (time, value text) of a port.
+
+    The port has an event at each tick with probability density (always at the first one), and its value changes
+    at an event with probability change. Values are 0/1, or several 0/1 fields separated by spaces if multival.
+    """
+    value = [0] * (fields if multival else 1)
+    sim_time = 0
+    for i in range(n_events):
+        if i:
+            sim_time += TICK
+            while rnd.random() >= density:
+                sim_time += TICK
+            if rnd.random() < change:
+                value[rnd.randrange(len(value))] ^= 1
+        yield sim_time, " ".join(map(str, value))
+
+
+def write_port(path, n_events, density=0.2, change=0.5, multival=False, seed=0):
+    rnd = random.Random(seed)
+    with open(path, "w") as f:
+        f.writelines("%s %s\n" % (format_time(sim_time), value)
+                     for sim_time, value in port_values(rnd, n_events, density, change, multival))
+
+
+def write_rules(path, n_inputs, n_outputs):
+    # Rules that always hold (values are never 2), so that the whole trace gets checked
+    with open(path, "w") as f:
+        for i in range(max(n_inputs, n_outputs)):
+            f.write("in:i%d == 1 -> out:o%d != 2\n" % (i % n_inputs, i % n_outputs))
+            f.write("out:o%d != 2 or in:i%d != 2\n" % (i % n_outputs, i % n_inputs))
+
+
+def generate_test_case(folder, n_ports=10, n_events=100000, density=0.2, change=0.5, multival=False, seed=0):
+    """Writes a test case with n_ports port files (half inputs, half outputs) of n_events lines and a rules file.
+
+    Returns (inputs, outputs, rules_path), the port maps of MetamorphicTestingHandler and the path of the rules.
+    """
+    os.makedirs(folder, exist_ok=True)
+    n_inputs = max(n_ports // 2, 1)
+    n_outputs = max(n_ports - n_inputs, 1)
+    inputs = {"i%d" % i: "in_%d.txt" % i for i in range(n_inputs)}
+    outputs = {"o%d" % i: "out_%d.txt" % i for i in range(n_outputs)}
+
+    for i, name in enumerate(list(inputs.values()) + list(outputs.values())):
+        write_port(os.path.join(folder, name), n_events, density, change, multival, seed=seed * 1000003 + i)
+
+    rules_path = os.path.join(folder, "rules.txt")
+    write_rules(rules_path, n_inputs, n_outputs)
+
+    with open(os.path.join(folder, "ports.json"), "w") as f:
+        json.dump({"inputs": inputs, "outputs": outputs}, f, indent=2)
+    return inputs, outputs, rules_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic test case (port files, ports.json and rules.txt).")
+    parser.add_argument("folder")
+    parser.add_argument("--ports", type=int, default=10, help="number of ports, half inputs and half outputs")
+    parser.add_argument("--events", type=int, default=100000, help="lines per port file")
+    parser.add_argument("--density", type=float, default=0.2, help="probability of an event of a port at each tick")
+    parser.add_argument("--change", type=float, default=0.5, help="probability of a value change at each event")
+    parser.add_argument("--multival", action="store_true", help="write several values per line")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_test_case(args.folder, args.ports, args.events, args.density, args.change, args.multival, args.seed)
@@ -1,11 +1,8 @@
 from testing import MetamorphicTestingHandler
-from visualization import Visualizer
+from building_relations import mm_relations
+from visualization import BoxesVisualizer
 
 import matplotlib
-import matplotlib.patches as patches
-import matplotlib.pyplot as plt
-import numpy as np
-from PIL import Image
 
 # matplotlib.use('module://backend_interagg')
 matplotlib.use('TkAgg')
@@ -18,8 +15,8 @@ THRESHOLD_LIGHT = 0.3
 
 INPUTS = {"ir1": "A1_IR_1.txt",
           "ir2": "A3_IR_2.txt",
-          "temp": "A4_TEMP_SENSOR.txt",
-          "light": "A5_LIGHT_SENSOR.txt",
+          "temp": ("A4_TEMP_SENSOR.txt", "float"),
+          "light": ("A5_LIGHT_SENSOR.txt", "float"),
           "fire_sw": "D12_FIRE_SWITCH.txt"}
 
 OUTPUTS = {"e1l1": "D2_E1L1.txt",
@@ -33,7 +30,7 @@ OUTPUTS = {"e1l1": "D2_E1L1.txt",
            "alarm": "D13_ALARM.txt"}
 
 
-class BuildingVisualizer(Visualizer):
+class BuildingVisualizer(BoxesVisualizer):
     BOXES = {"ir1": ((14, 72), (64, 122)),
              "ir2": ((14, 144), (64, 195)),
              "light": ((14, 211), (64, 261)),
@@ -50,124 +47,21 @@ class BuildingVisualizer(Visualizer):
              "alarm": ((254, 250), (254, 287))
              }
     IMAGE_PATH = "img/building_top.png"
+    LINEWIDTHS = {"alarm": 1}
+    PAUSE = 0.5
 
-    def __init__(self):
-        self.img = np.array(Image.open(BuildingVisualizer.IMAGE_PATH), dtype=np.uint8)
-        self.fig, self.ax = plt.subplots(1)
-        self.ax.imshow(self.img)
-        plt.ion()
-        plt.show()
+    def color(self, port_type, port, state):
+        if port == "temp":
+            return 'b' if state <= THRESHOLD_TEMP else 'r'
+        elif port == "light":
+            return 'b' if state <= THRESHOLD_LIGHT else 'r'
+        return 'r' if state == 1 else 'b'
 
-    def update(self, wr):
-        for port in wr.inputs:
-            if port in BuildingVisualizer.BOXES:
-                tl, br = BuildingVisualizer.BOXES[port]
-                if port == "temp":
-                    color = 'b' if wr.inputs[port].curr_state <= THRESHOLD_TEMP else 'r'
-                elif port == "light":
-                    color = 'b' if wr.inputs[port].curr_state <= THRESHOLD_LIGHT else 'r'
-                else:
-                    color = 'r' if wr.inputs[port].curr_state == 1 else 'b'
-                rect = patches.Rectangle(tl, br[0] - tl[0], br[1] - tl[1], linewidth=2, edgecolor=color,
-                                         facecolor='none')
-                self.ax.add_patch(rect)
-
-        for port in wr.outputs:
-            if port in BuildingVisualizer.BOXES:
-                tl, br = BuildingVisualizer.BOXES[port]
-                color = 'r' if wr.outputs[port].curr_state == 1 else 'b'
-                width = 2 if port != "alarm" else 1
-                rect = patches.Rectangle(tl, br[0] - tl[0], br[1] - tl[1], linewidth=width, edgecolor=color,
-                                         facecolor='none')
-                self.ax.add_patch(rect)
-
-    def show(self):
-        plt.draw()
-        plt.pause(0.5)
-
-
-# --------------------------------------------------------------------------
-# METHAMORPHIC RELATIONS
-# -----------------------
-
-# Alarm must be activated when some of the red emergency LEDs is turned on
-def alarm_when_some_red_led(inputs, outputs):
-    if outputs["e1l1"].curr_state == 1 or outputs["e2l1"].curr_state == 1:
-        assert outputs["alarm"].curr_state == 1
-
-
-# If a red emergency LED is activated in a EC one LED has to be activated in the other EC (wither red or green)
-def emergency_controllers_red_dependency(inputs, outputs):
-    if outputs["e1l1"].curr_state == 1:
-        assert (outputs["e2l1"].curr_state == 1 and outputs["e2l2"].curr_state == 0) or \
-                (outputs["e2l1"].curr_state == 0 and outputs["e2l2"].curr_state == 1)
-
-    if outputs["e2l1"].curr_state == 1:
-        assert (outputs["e1l1"].curr_state == 1 and outputs["e1l2"].curr_state == 0) or \
-               (outputs["e1l1"].curr_state == 0 and outputs["e1l2"].curr_state == 1)
-
-
-# Green emergency LEDs are only turned on when the contrary red LEDs are activated
-def emergency_controllers_red_green_dependency(inputs, outputs):
-    if outputs["e1l2"].curr_state == 1:
-        assert outputs["e2l1"].curr_state == 1
-
-    if outputs["e2l2"].curr_state == 1:
-        assert outputs["e1l1"].curr_state == 1
-
-
-# The outputs of an Emergency LED Controller can not be activated simultaneously
-def exclusive_emergency_controller_outputs(inputs, outputs):
-    assert outputs["e1l1"].curr_state == 0 or outputs["e1l2"].curr_state == 0
-    assert outputs["e2l1"].curr_state == 0 or outputs["e2l2"].curr_state == 0
-
-
-# When alarm is not fired the lights has some dependencies with the IR sensors:
-#    - The output of the first light in a room has to be the same than the IR input related with the same room.
-#    - The second light of a room can not be turned on if the first light is not turned on.
-def lights_ir_dependencies_without_alarm(inputs, outputs):
-    if outputs["alarm"].curr_state == 0:
-        assert outputs["r1l1"].curr_state == inputs["ir1"].curr_state
-        assert outputs["r2l1"].curr_state == inputs["ir2"].curr_state
-
-        if outputs["r1l2"].curr_state == 1:
-            assert outputs["r1l1"].curr_state == 1
-
-        if outputs["r2l2"].curr_state == 1:
-            assert outputs["r2l1"].curr_state == 1
-
-
-# All the lights have to be turned on when an alarm is raised
-def lights_on_when_alarm_activated(inputs, outputs):
-    if outputs["alarm"].curr_state == 1:
-        assert outputs["r1l1"].curr_state == 1
-        assert outputs["r1l2"].curr_state == 1
-        assert outputs["r2l1"].curr_state == 1
-        assert outputs["r2l2"].curr_state == 1
-
-def rule_with_mem(inputs, outputs, mem):
-    if "cont" not in mem:
-        mem["cont"] = 0
-
-    mem["cont"] += 1
-    return mem
-
-
-
-
-mm_relations = {
-    "alarm_when_some_red_led": alarm_when_some_red_led,
-    "emergency_controllers_red_dependency": emergency_controllers_red_dependency,
-    "emergency_controllers_red_green_dependency": emergency_controllers_red_green_dependency,
-    "exclusive_emergency_controller_outputs": exclusive_emergency_controller_outputs,
-    "lights_ir_dependencies_without_alarm": lights_ir_dependencies_without_alarm,
-    "lights_on_when_alarm_activated": lights_on_when_alarm_activated,
-    "rule_with_mem": rule_with_mem
-}
 
 mmth = MetamorphicTestingHandler(INPUTS, OUTPUTS,
                                  visualizer=None)
                                  # visualizer=BuildingVisualizer())
+                                 # visualizer=BuildingVisualizer(output="frames/building"))
 
 mm_relations_filename = "building_rules.txt"
 mmth.run_test_case("sim1", IN_PATH, OUT_PATH, mm_relations, mm_relations_filename)
@@ -0,0 +1,78 @@
+# --------------------------------------------------------------------------
+# METHAMORPHIC RELATIONS
+# -----------------------
+
+# Alarm must be activated when some of the red emergency LEDs is turned on
+def alarm_when_some_red_led(inputs, outputs):
+    if outputs["e1l1"].curr_state == 1 or outputs["e2l1"].curr_state == 1:
+        assert outputs["alarm"].curr_state == 1
+
+
+# If a red emergency LED is activated in a EC one LED has to be activated in the other EC (wither red or green)
+def emergency_controllers_red_dependency(inputs, outputs):
+    if outputs["e1l1"].curr_state == 1:
+        assert (outputs["e2l1"].curr_state == 1 and outputs["e2l2"].curr_state == 0) or \
+                (outputs["e2l1"].curr_state == 0 and outputs["e2l2"].curr_state == 1)
+
+    if outputs["e2l1"].curr_state == 1:
+        assert (outputs["e1l1"].curr_state == 1 and outputs["e1l2"].curr_state == 0) or \
+               (outputs["e1l1"].curr_state == 0 and outputs["e1l2"].curr_state == 1)
+
+
+# Green emergency LEDs are only turned on when the contrary red LEDs are activated
+def emergency_controllers_red_green_dependency(inputs, outputs):
+    if outputs["e1l2"].curr_state == 1:
+        assert outputs["e2l1"].curr_state == 1
+
+    if outputs["e2l2"].curr_state == 1:
+        assert outputs["e1l1"].curr_state == 1
+
+
+# The outputs of an Emergency LED Controller can not be activated simultaneously
+def exclusive_emergency_controller_outputs(inputs, outputs):
+    assert outputs["e1l1"].curr_state == 0 or outputs["e1l2"].curr_state == 0
+    assert outputs["e2l1"].curr_state == 0 or outputs["e2l2"].curr_state == 0
+
+
+# When alarm is not fired the lights has some dependencies with the IR sensors:
+#    - The output of the first light in a room has to be the same than the IR input related with the same room.
+#    - The second light of a room can not be turned on if the first light is not turned on.
+def lights_ir_dependencies_without_alarm(inputs, outputs):
+    if outputs["alarm"].curr_state == 0:
+        assert outputs["r1l1"].curr_state == inputs["ir1"].curr_state
+        assert outputs["r2l1"].curr_state == inputs["ir2"].curr_state
+
+        if outputs["r1l2"].curr_state == 1:
+            assert outputs["r1l1"].curr_state == 1
+
+        if outputs["r2l2"].curr_state == 1:
+            assert outputs["r2l1"].curr_state == 1
+
+
+# All the lights have to be turned on when an alarm is raised
+def lights_on_when_alarm_activated(inputs, outputs):
+    if outputs["alarm"].curr_state == 1:
+        assert outputs["r1l1"].curr_state == 1
+        assert outputs["r1l2"].curr_state == 1
+        assert outputs["r2l1"].curr_state == 1
+        assert outputs["r2l2"].curr_state == 1
+
+def rule_with_mem(inputs, outputs, mem):
+    if "cont" not in mem:
+        mem["cont"] = 0
+
+    mem["cont"] += 1
+    return mem
+
+
+
+
+mm_relations = {
+    "alarm_when_some_red_led": alarm_when_some_red_led,
+    "emergency_controllers_red_dependency": emergency_controllers_red_dependency,
+    "emergency_controllers_red_green_dependency": emergency_controllers_red_green_dependency,
+    "exclusive_emergency_controller_outputs": exclusive_emergency_controller_outputs,
+    "lights_ir_dependencies_without_alarm": lights_ir_dependencies_without_alarm,
+    "lights_on_when_alarm_activated": lights_on_when_alarm_activated,
+    "rule_with_mem": rule_with_mem
+}
@@ -0,0 +1,293 @@
+import argparse
+import contextlib
+import hashlib
+import importlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from schema import port_file
+
+CACHE_DIR = ".mmpy_results"
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class TestCaseResult:
+    """Compact outcome of a test case: what a worker sends back to the parent process."""
+
+    PASSED = "passed"
+    FAILED = "failed"  # A relation was not accomplished
+    ERROR = "error"  # The test case could not be run (missing files, bad rules...)
+
+    def __init__(self, tc_id, status, steps, elapsed, message=None, sim_time=None, output=None, cached=False):
+        self.tc_id = tc_id
+        self.status = status
+        self.steps = steps
+        self.elapsed = elapsed
+        self.message = message
+        self.sim_time = sim_time  # Simulation time where the test case failed
+        self.output = output  # Captured print output, if requested
+        self.cached = cached  # Taken from the result cache instead of being run
+
+    def to_dict(self):
+        return {"tc_id": self.tc_id, "status": self.status, "steps": self.steps, "elapsed": self.elapsed,
+                "message": self.message, "sim_time": self.sim_time, "cached": self.cached}
+
+    def __repr__(self):
+        return "TestCaseResult(%r, %r, steps=%d)" % (self.tc_id, self.status, self.steps)
+
+
+class CampaignReport:
+    """Results of several test cases, in the order they were given."""
+
+    def __init__(self, results, elapsed, workers):
+        self.results = results
+        self.elapsed = elapsed
+        self.workers = workers
+
+    def by_status(self, status):
+        return [result for result in self.results if result.status == status]
+
+    @property
+    def passed(self):
+        return self.by_status(TestCaseResult.PASSED)
+
+    @property
+    def failed(self):
+        return self.by_status(TestCaseResult.FAILED)
+
+    @property
+    def errors(self):
+        return self.by_status(TestCaseResult.ERROR)
+
+    @property
+    def ok(self):
+        return all(result.status == TestCaseResult.PASSED for result in self.results)
+
+    @property
+    def steps(self):
+        return sum(result.steps for result in self.results)
+
+    def to_dict(self):
+        return {"elapsed": self.elapsed, "workers": self.workers, "steps": self.steps,
+                "results": [result.to_dict() for result in self.results]}
+
+    def summary(self):
+        lines = []
+        for result in self.results:
+            line = "%-8s %s (%d steps, %.3f s%s)" % (result.status.upper(), result.tc_id, result.steps, result.elapsed,
+                                                     ", cached" if result.cached else "")
+            if result.message is not None:
+                at = " at %.3f" % (result.sim_time / 1000) if result.sim_time is not None else ""
+                line += "\n         %s%s" % (result.message.replace("\n", "\n         "), at)
+            lines.append(line)
+
+        lines.append("%d test cases: %d passed, %d failed, %d errors (%d steps, %.3f s, %d workers)" % (
+            len(self.results), len(self.passed), len(self.failed), len(self.errors), self.steps, self.elapsed,
+            self.workers))
+        return "\n".join(lines)
+
+
+def run_test_case(handler_config, tc_id, input_path, output_path, relations_fun, relations_fn, capture_output=False,
+                  t_start=None, t_end=None):
+    """Runs a test case (or the window [t_start, t_end] of it) on a new MetamorphicTestingHandler and returns its
+    TestCaseResult.
+
+    The print output of the handler is captured (and dropped unless capture_output is set), so that test cases
+    running at the same time do not mix their output.
+    """
+    from testing import MetamorphicTestingHandler
+
+    handler = MetamorphicTestingHandler(**handler_config)
+    buffer = io.StringIO()
+    status, message = TestCaseResult.PASSED, None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(buffer):
+        try:
+            handler.run_test_case(tc_id, input_path, output_path, relations_fun, relations_fn, t_start, t_end)
+        except AssertionError as e:
+            # Function relations fail with assertions, file relations with "Rule not accomplished"
+            status, message = TestCaseResult.FAILED, str(e) or "assertion failed"
+        except RuntimeError as e:
+            failed = str(e).startswith("Rule not accomplished")
+            status, message = TestCaseResult.FAILED if failed else TestCaseResult.ERROR, str(e)
+        except Exception as e:
+            status, message = TestCaseResult.ERROR, "%s: %s" % (type(e).__name__, e)
+    elapsed = time.perf_counter() - start
+
+    steps = len(handler.port_values[tc_id]) if tc_id in handler.port_values else 0
+    sim_time = handler.sim_time if status == TestCaseResult.FAILED else None
+    return TestCaseResult(tc_id, status, steps, elapsed, message, sim_time,
+                          buffer.getvalue() if capture_output else None)
+
+
+def run_test_cases(handler_config, test_cases, relations_fun=None, relations_fn=None, workers=None,
+                   capture_output=False):
+    """Runs a list of (tc_id, input_path, output_path) on a pool of worker processes. Returns a CampaignReport.
+
+    handler_config holds the keyword arguments of the MetamorphicTestingHandler created for each test case.
+    Relation functions are sent to the workers, so they must be picklable (defined at module level). With a
+    single worker the test cases are run in the calling process.
+    """
+    test_cases = list(test_cases)
+    workers = min(workers or os.cpu_count() or 1, max(len(test_cases), 1))
+    start = time.perf_counter()
+
+    args = [(handler_config, tc_id, input_path, output_path, relations_fun, relations_fn, capture_output)
+            for tc_id, input_path, output_path in test_cases]
+    if workers == 1:
+        results = [run_test_case(*tc_args) for tc_args in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_test_case, *zip(*args)))
+
+    return CampaignReport(results, time.perf_counter() - start, workers)
+
+
+def file_hash(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest
+
+
+class Manifest:
+    """Scenario of a campaign, read from a JSON file:
+
+        {"name": "building",
+         "inputs": {port: file name}, "outputs": {port: file name}, "multival": false,
+                        (or {port: [file name, schema]}, see schema.py)
+         "relations": "module:dict_name",  (optional) dict of relation functions
+         "rules": "rules.txt",  (optional) rules file
+         "test_cases": {tc_id: [input_path, output_path]}}
+
+    Paths are relative to the manifest. The relations module is imported from the folder of the manifest or from
+    sys.path.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.folder = os.path.dirname(self.path)
+        with open(self.path, "r") as f:
+            data = json.load(f)
+
+        self.name = data.get("name", os.path.splitext(os.path.basename(path))[0])
+        self.inputs = data["inputs"]
+        self.outputs = data["outputs"]
+        self.multival = data.get("multival", False)
+        self.relations_ref = data.get("relations")
+        self.rules = self.resolve(data["rules"]) if data.get("rules") else None
+        self.test_cases = [(tc_id, self.resolve(input_path), self.resolve(output_path))
+                           for tc_id, (input_path, output_path) in data["test_cases"].items()]
+
+        self.relations = None
+        self.relations_source = None
+        if self.relations_ref is not None:
+            module_name, _, attr = self.relations_ref.partition(":")
+            if self.folder not in sys.path:
+                sys.path.insert(0, self.folder)
+            module = importlib.import_module(module_name)
+            self.relations = getattr(module, attr or "mm_relations")
+            self.relations_source = module.__file__
+
+    def resolve(self, path):
+        return os.path.normpath(os.path.join(self.folder, path))
+
+    def handler_config(self):
+        return {"input_filenames": self.inputs, "output_filenames": self.outputs, "multival": self.multival,
+                "verbose": False}
+
+    def test_case_key(self, input_path, output_path):
+        """Hash of everything the result of a test case depends on, or None if some file cannot be read."""
+        digest = hashlib.sha256()
+        digest.update(json.dumps([self.inputs, self.outputs, self.multival, self.relations_ref],
+                                 sort_keys=True).encode())
+        try:
+            for path in [self.rules, self.relations_source] + \
+                        [os.path.join(input_path, port_file(entry)[0]) for entry in self.inputs.values()] + \
+                        [os.path.join(output_path, port_file(entry)[0]) for entry in self.outputs.values()]:
+                digest.update(b"\0")
+                if path is not None:
+                    file_hash(path, digest)
+        except OSError:
+            return None
+        return digest.hexdigest()
+
+
+class ResultCache:
+    """Results of test cases stored as JSON files in a folder, keyed on the hash of their inputs."""
+
+    def __init__(self, folder=CACHE_DIR):
+        self.folder = folder
+
+    def path(self, key):
+        return os.path.join(self.folder, key[:2], key + ".json")
+
+    def get(self, key, tc_id):
+        try:
+            with open(self.path(key), "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # The result may come from another test case with the same files
+        data.update(tc_id=tc_id, cached=True)
+        return TestCaseResult(**data)
+
+    def put(self, key, result):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = result.to_dict()
+        del data["cached"]
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+
+def run_manifest(manifest, workers=None, cache=None):
+    """Runs the test cases of a Manifest whose results are not in the ResultCache cache (if any)."""
+    start = time.perf_counter()
+    keys = {tc_id: manifest.test_case_key(input_path, output_path) if cache is not None else None
+            for tc_id, input_path, output_path in manifest.test_cases}
+    cached = {tc_id: cache.get(key, tc_id) for tc_id, key in keys.items() if key is not None}
+
+    pending = [test_case for test_case in manifest.test_cases if cached.get(test_case[0]) is None]
+    report = run_test_cases(manifest.handler_config(), pending, manifest.relations, manifest.rules, workers)
+    new_results = {result.tc_id: result for result in report.results}
+
+    results = []
+    for tc_id, _, _ in manifest.test_cases:
+        result = cached.get(tc_id) or new_results[tc_id]
+        # Errors (e.g. missing files) are not cached, so they are retried
+        if not result.cached and keys[tc_id] is not None and result.status != TestCaseResult.ERROR:
+            cache.put(keys[tc_id], result)
+        results.append(result)
+
+    return CampaignReport(results, time.perf_counter() - start, report.workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the test cases of one or more campaign manifests.")
+    parser.add_argument("manifests", nargs="+", help="JSON manifests (see campaign.Manifest)")
+    parser.add_argument("-j", "--workers", type=int, help="worker processes (default: number of CPUs)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="folder of the result cache (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="run every test case, ignoring the result cache")
+    parser.add_argument("--json", help="write the reports to this file")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else ResultCache(args.cache_dir)
+    reports = {}
+    for manifest_path in args.manifests:
+        manifest = Manifest(manifest_path)
+        report = run_manifest(manifest, args.workers, cache)
+        reports[manifest.name] = report
+        print("%s:\n%s\n" % (manifest.name, report.summary()))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({name: report.to_dict() for name, report in reports.items()}, f, indent=2)
+
+    sys.exit(0 if all(report.ok for report in reports.values()) else 1)
@@ -1,11 +1,7 @@
 from testing import MetamorphicTestingHandler
-from visualization import Visualizer
+from visualization import BoxesVisualizer
 
 import matplotlib
-import matplotlib.patches as patches
-import matplotlib.pyplot as plt
-import numpy as np
-from PIL import Image
 
 # matplotlib.use('module://backend_interagg')
 matplotlib.use('TkAgg')
@@ -23,7 +19,7 @@ OUTPUTS = {"right_motor1": "D8_RightMotor1_Out.txt",
            "left_motor2": "D13_LeftMotor2_Out.txt"}
 
 
-class CarVisualizer(Visualizer):
+class CarVisualizer(BoxesVisualizer):
     BOXES = {"ir_right": ((1, 55), (80, 95)),
              "ir_center": ((1, 125), (80, 165)),
              "ir_left": ((1, 195), (80, 235)),
@@ -33,46 +29,14 @@ class CarVisualizer(Visualizer):
              "left_motor2": ((440, 227), (520, 267))
              }
     IMAGE_PATH = "img/seed_bot_driver_top.png"
-
-    def __init__(self):
-        self.img = np.array(Image.open(CarVisualizer.IMAGE_PATH), dtype=np.uint8)
-        self.fig, self.ax = plt.subplots(1)
-        self.ax.imshow(self.img)
-        plt.ion()
-        plt.show()
-
-    def update(self, wr):
-        for port in wr.inputs:
-            if port in CarVisualizer.BOXES:
-                tl, br = CarVisualizer.BOXES[port]
-
-                if wr.inputs[port].curr_state == 0:
-                    color = "blue"
-                elif 0 < wr.inputs[port].curr_state < 1:
-                    color = "purple"
-                else:
-                    color = "red"
-
-                rect = patches.Rectangle(tl, br[0] - tl[0], br[1] - tl[1], linewidth=2, edgecolor=color,
-                                         facecolor='none')
-                self.ax.add_patch(rect)
-
-        for port in wr.outputs:
-            if port in CarVisualizer.BOXES:
-                tl, br = CarVisualizer.BOXES[port]
-                if wr.outputs[port].curr_state == 0:
-                    color = "blue"
-                elif 0 < wr.outputs[port].curr_state < 1:
-                    color = "purple"
-                else:
-                    color = "red"
-                rect = patches.Rectangle(tl, br[0] - tl[0], br[1] - tl[1], linewidth=2, edgecolor=color,
-                                         facecolor='none')
-                self.ax.add_patch(rect)
-
-    def show(self):
-        plt.draw()
-        plt.pause(8)
+    PAUSE = 8
+
+    def color(self, port_type, port, state):
+        if state == 0:
+            return "blue"
+        elif 0 < state < 1:
+            return "purple"
+        return "red"
 
 
 # --------------------------------------------------------------------------
@@ -0,0 +1,144 @@
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+
+READ_BUFFER_SIZE = 1 << 20  # Bytes read (and decompressed) at once
+MAX_CHUNKS = 8  # Decompressed chunks buffered ahead by the background thread
+
+EXTENSIONS = {".gz": "gzip", ".xz": "xz", ".zst": "zstd"}
+MAGIC_BYTES = {b"\x1f\x8b": "gzip", b"\xfd7zXZ\x00": "xz", b"\x28\xb5\x2f\xfd": "zstd"}
+
+
+def detect_codec(path, head=b""):
+    """Compression of a file ("gzip", "xz", "zstd" or None) from its extension, or else from its first bytes."""
+    codec = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if codec is None:
+        for magic, magic_codec in MAGIC_BYTES.items():
+            if head.startswith(magic):
+                return magic_codec
+    return codec
+
+
+def open_decompressed(path, codec):
+    # Binary stream of the decompressed contents
+    if codec == "gzip":
+        return gzip.open(path, "rb")
+    elif codec == "xz":
+        return lzma.open(path, "rb")
+    elif codec == "zstd":
+        try:
+            from compression import zstd  # Python 3.14+
+            return zstd.open(path, "rb")
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading .zst traces requires Python 3.14 or the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_size=READ_BUFFER_SIZE,
+                                                          closefd=True)
+    raise ValueError("Unknown codec: %r" % codec)
+
+
+def read_chunks(stream, chunk_size, chunks, stopped):
+    # Body of the thread of a ThreadedReader: an empty chunk marks the end, an exception is passed on
+
+    def put(item):
+        # Gives up if the reader is closed while the queue is full
+        while not stopped.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    try:
+        while not stopped.is_set():
+            chunk = stream.read(chunk_size)
+            put(chunk)
+            if not chunk:
+                return
+    except Exception as e:
+        put(e)
+
+
+class ThreadedReader(io.RawIOBase):
+    """Reads a binary stream on a background thread, chunk_size bytes at a time, so that its decompression overlaps
+    with the work of the thread consuming it (zlib and lzma release the GIL). At most max_chunks are read ahead."""
+
+    def __init__(self, stream, chunk_size=READ_BUFFER_SIZE, max_chunks=MAX_CHUNKS):
+        super().__init__()
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(max_chunks)
+        self.chunk = memoryview(b"")
+        self.done = False
+        self.stopped = threading.Event()
+        # The thread does not hold a reference to the reader, so an unreferenced reader is closed and stops it
+        self.thread = threading.Thread(target=read_chunks, args=(stream, chunk_size, self.chunks, self.stopped),
+                                       name="mmpy-decompress", daemon=True)
+        self.thread.start()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.chunk and not self.done:
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                self.done = True
+                raise chunk
+            self.done = not chunk
+            self.chunk = memoryview(chunk)
+
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.stream.close()
+        super().close()
+
+
+def open_trace(path, threaded=True):
+    """Opens a port file for reading as text, decompressing it on the fly if it is a .gz, .xz or .zst file (or
+    starts with their magic bytes). Compressed files are decompressed on a background thread unless threaded is
+    False, in which case the stream stays seekable."""
+    raw = open(path, "rb", buffering=READ_BUFFER_SIZE)
+    codec = detect_codec(path, raw.peek(6)[:6])
+    if codec is None:
+        return io.TextIOWrapper(raw)
+
+    raw.close()
+    stream = open_decompressed(path, codec)
+    if threaded:
+        stream = io.BufferedReader(ThreadedReader(stream), buffer_size=READ_BUFFER_SIZE)
+    return io.TextIOWrapper(stream)
+
+
+def open_output(path):
+    """Opens a trace file for writing as text, compressed according to its extension (.gz, .xz or .zst)."""
+    codec = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if codec == "gzip":
+        return gzip.open(path, "wt")
+    elif codec == "xz":
+        return lzma.open(path, "wt")
+    elif codec == "zstd":
+        try:
+            from compression import zstd  # Python 3.14+
+            return zstd.open(path, "wt")
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Writing .zst traces requires Python 3.14 or the zstandard package")
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True))
+    return open(path, "w", buffering=READ_BUFFER_SIZE)
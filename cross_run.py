@@ -0,0 +1,76 @@
+import itertools
+from types import SimpleNamespace
+
+from testing import EventScheduler, close_monitors
+
+
+class CrossRunScheduler:
+    """Merge-join of the event streams of several test cases on simulation time.
+
+    Each run keeps its own EventScheduler, so its port files are read as a stream. The time of a run is shifted by
+    its offset (ms, subtracted from its times), and events of different runs closer than tolerance (ms) are joined
+    in the same step. Every step of every run is visited, and the join ends as soon as one of the runs ends.
+    """
+
+    def __init__(self, schedulers: dict, offsets: dict = None, tolerance: int = 0):
+        self.schedulers = schedulers
+        self.offsets = offsets or {}
+        self.tolerance = tolerance
+
+    def run_time(self, tc_id):
+        run_time = self.schedulers[tc_id].next_time()
+        return None if run_time is None else run_time - self.offsets.get(tc_id, 0)
+
+    def next_time(self):
+        times = [self.run_time(tc_id) for tc_id in self.schedulers]
+        if None in times:
+            return None
+        return min(times)
+
+    def advance(self, sim_time):
+        changed = []
+        for tc_id, scheduler in self.schedulers.items():
+            run_time = self.run_time(tc_id)
+            if run_time is not None and run_time <= sim_time + self.tolerance:
+                changed += [(tc_id, port_type, port)
+                            for port_type, port in scheduler.advance(run_time + self.offsets.get(tc_id, 0))]
+        return changed
+
+
+def run_cross_test_cases(handler, test_cases: dict, relations: dict, tolerance: int = 0, offsets: dict = None):
+    """Checks relations between several test cases (e.g. a source and a follow-up execution) at every step of their
+    joined timeline (see CrossRunScheduler). Returns the number of steps.
+
+    test_cases maps tc_id to (input_path, output_path). The relations receive a dict tc_id -> run, where run.inputs
+    and run.outputs are the monitors of the test case, and fail with an AssertionError as single run relations.
+    """
+    runs = {}
+    try:
+        for tc_id, (input_path, output_path) in test_cases.items():
+            inputs, outputs = handler.open_monitors(input_path, output_path)
+            runs[tc_id] = SimpleNamespace(inputs=inputs, outputs=outputs)
+        schedulers = {tc_id: EventScheduler(run.inputs, run.outputs) for tc_id, run in runs.items()}
+        scheduler = CrossRunScheduler(schedulers, offsets, tolerance)
+
+        steps = 0
+        handler.sim_time = scheduler.next_time()
+        while handler.sim_time is not None:
+            if handler.verbose:
+                print("\nExecuting simulation time %.3f" % (handler.sim_time / 1000))
+            scheduler.advance(handler.sim_time)
+            steps += 1
+
+            for rel_name, rel_fun in relations.items():
+                if handler.verbose:
+                    print("Checking %s relation..." % rel_name)
+
+                if handler.profiler is None:
+                    rel_fun(runs)
+                else:
+                    handler.profiler.time_relation(rel_name, rel_fun, runs)
+
+            handler.sim_time = scheduler.next_time()
+
+        return steps
+    finally:
+        close_monitors(*itertools.chain.from_iterable((run.inputs, run.outputs) for run in runs.values()))
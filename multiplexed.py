@@ -0,0 +1,176 @@
+import argparse
+import heapq
+import json
+import os
+import tempfile
+import time
+from functools import partial
+from operator import itemgetter
+
+from compressed import open_output, open_trace
+from schema import PortSchema, port_file
+from testing import StatesMonitor, parse_value, simulation_end_time
+from time_index import last_time
+
+MAX_OPEN_FILES = 256  # Port files read at once by the converter
+RAW = PortSchema("str")  # Values are copied as they are written
+
+
+class MultiplexedTrace:
+    """Reader of a multiplexed trace: the events of every port of a test case in a single time-sorted file, one
+    line "<time_ms> <in|out>:<port> <value>" per event (compressed files are read as in StatesMonitor).
+
+    Iterating over it yields batches of (port_type, port, time, state) events, as a SocketEventSource, so a single
+    sequential reader feeds a StreamScheduler. Values are parsed as in the port files, or with the PortSchema of
+    their port in schemas ({(port_type, port): PortSchema}). The file is closed by close() or at the end of a with
+    block.
+    """
+
+    def __init__(self, path, multival=False, schemas=None):
+        self.path = path
+        self.multival = multival
+        self.schemas = schemas or {}
+        self.parsers = {}  # port_ref -> (port_type, port, value parser)
+        self.in_stream = open_trace(path)
+        self.parse_time = 0.0  # Time spent reading and parsing the file (s)
+
+    def __iter__(self):
+        pending = ""
+        while True:
+            start = time.perf_counter()
+            text = self.in_stream.read(StatesMonitor.BLOCK_SIZE)
+            if not text:
+                if pending.strip():
+                    yield self.timed_parse(pending, start)
+                return
+
+            text = pending + text
+            line_end = text.rfind("\n") + 1
+            pending = text[line_end:]
+            if line_end:
+                yield self.timed_parse(text[:line_end - 1], start)
+
+    def timed_parse(self, text, start):
+        events = self.parse_events(text)
+        self.parse_time += time.perf_counter() - start
+        return events
+
+    def parser(self, port_type, port):
+        schema = self.schemas.get((port_type, port))
+        if schema is not None:
+            return schema.parse
+        return partial(parse_value, multival=self.multival)
+
+    def parse_events(self, text):
+        events = []
+        parsers = self.parsers
+        for line in text.split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                event_time, port_ref, value = line.split(" ", 2)
+                port = parsers.get(port_ref)
+                if port is None:
+                    port_type, name = port_ref.split(":", 1)
+                    port = parsers[port_ref] = (port_type, name, self.parser(port_type, name))
+                port_type, name, parse = port
+                events.append((port_type, name, int(event_time), parse(value.strip())))
+            except ValueError:
+                raise RuntimeError("Malformed event in %s: %r" % (self.path, line))
+        return events
+
+    def close(self):
+        self.in_stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def port_events(path, port_ref):
+    """Generator of the (time, port_ref, value text) events of a port file, with the last value of every time."""
+    with StatesMonitor(path, schema=RAW) as mon:
+        while mon.next_time is not None:
+            mon.advance()
+            yield mon.curr_time, port_ref, mon.curr_state
+
+
+def trace_events(path):
+    """Generator of the (time, port_ref, value text) events of a multiplexed trace."""
+    with open_trace(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                event_time, port_ref, value = line.split(" ", 2)
+                yield int(event_time), port_ref, value
+
+
+def merge_events(sources, dest, end_time=None):
+    """Writes the events of several time-sorted generators of (time, port_ref, value text) to a multiplexed trace,
+    up to end_time. The generators are closed at the end."""
+    streams = [source() for source in sources]
+    try:
+        with open_output(dest) as f:
+            for event_time, port_ref, value in heapq.merge(*streams, key=itemgetter(0)):
+                if end_time is not None and event_time > end_time:
+                    break
+                f.write("%d %s %s\n" % (event_time, port_ref, value))
+    finally:
+        for stream in streams:
+            stream.close()
+
+
+def end_time(port_paths):
+    # Time of the last step of the test case (-1 if it has no steps)
+    last_times = {"in": [], "out": []}
+    for port_ref, path in port_paths:
+        with StatesMonitor(path, schema=RAW) as mon:
+            if mon.next_time is not None:
+                last_times[port_ref.split(":", 1)[0]].append(last_time(mon))
+    last = simulation_end_time(last_times)
+    return -1 if last is None else last
+
+
+def convert(inputs, outputs, input_path, output_path, dest, max_open=MAX_OPEN_FILES):
+    """Writes the port files of a test case (with the INPUTS/OUTPUTS maps of a handler) to the multiplexed trace dest,
+    compressed if it ends in .gz, .xz or .zst. Only the events of the steps a handler would check are kept.
+
+    At most max_open port files are open at once: with more ports, groups of them are merged to temporary traces
+    first, which are then merged in turn.
+    """
+    port_paths = [("in:%s" % port, os.path.join(input_path, port_file(entry)[0])) for port, entry in inputs.items()]
+    port_paths += [("out:%s" % port, os.path.join(output_path, port_file(entry)[0]))
+                   for port, entry in outputs.items()]
+    last = end_time(port_paths)
+
+    sources = [partial(port_events, path, port_ref) for port_ref, path in port_paths]
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(dest))) as tmp_dir:
+        level = 0
+        while len(sources) > max_open:
+            merged = []
+            for i in range(0, len(sources), max_open):
+                path = os.path.join(tmp_dir, "%d_%d.mux" % (level, i // max_open))
+                merge_events(sources[i:i + max_open], path, last)
+                merged.append(partial(trace_events, path))
+            sources = merged
+            level += 1
+        merge_events(sources, dest, last)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the port files of a test case to a multiplexed trace.")
+    parser.add_argument("ports", help="JSON file with the port maps ({\"inputs\": ..., \"outputs\": ...}), e.g. a "
+                                      "campaign manifest")
+    parser.add_argument("input_path")
+    parser.add_argument("output_path")
+    parser.add_argument("dest", help="multiplexed trace to write (.gz, .xz or .zst to compress it)")
+    parser.add_argument("--max-open", type=int, default=MAX_OPEN_FILES, help="port files open at once")
+    args = parser.parse_args()
+
+    with open(args.ports, "r") as f:
+        ports = json.load(f)
+    convert(ports["inputs"], ports["outputs"], args.input_path, args.output_path, args.dest, args.max_open)
@@ -0,0 +1,109 @@
+import json
+import math
+import time
+
+PERCENTILES = (50, 90, 99)
+MIN_DURATION = 1e-8  # Upper bound of the first histogram bucket (s)
+BUCKET_GROWTH = 1.05  # Ratio between the bounds of consecutive buckets, so percentiles are within about 2.5%
+LOG_GROWTH = math.log(BUCKET_GROWTH)
+
+
+class DurationStats:
+    """Summary of the call durations of a relation in bounded memory: count, total and max, plus a histogram of
+    logarithmic buckets for approximate percentiles."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}  # bucket -> calls, bucket k holding durations up to MIN_DURATION * BUCKET_GROWTH ** k
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        bucket = math.ceil(math.log(duration / MIN_DURATION) / LOG_GROWTH) if duration > MIN_DURATION else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, p):
+        # Geometric middle of the bucket holding the nearest-rank percentile, capped at max
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(MIN_DURATION * BUCKET_GROWTH ** (bucket - 0.5), self.max)
+        return self.max
+
+
+class Profiler:
+    """Instrumentation of the test cases run by a TestingHandler (see TestingHandler(..., profile=True)).
+
+    Keeps the count, total, max and approximate percentiles of the durations of the calls of every relation (see
+    DurationStats), and per test case the number of steps and events, the wall time and the time spent reading and
+    parsing each port file.
+    """
+
+    def __init__(self):
+        self.durations = {}  # relation -> DurationStats of its calls (s)
+        self.runs = []
+        self.run = None
+
+    def time_relation(self, name, fun, *args):
+        start = time.perf_counter()
+        try:
+            return fun(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            durations = self.durations.get(name)
+            if durations is None:
+                durations = self.durations[name] = DurationStats()
+            durations.add(elapsed)
+
+    def start_run(self, tc_id):
+        self.run = {"tc_id": tc_id, "steps": 0, "events": 0, "start": time.perf_counter()}
+        self.runs.append(self.run)
+
+    def add_step(self, events):
+        self.run["steps"] += 1
+        self.run["events"] += events
+
+    def end_run(self, inputs, outputs):
+        run = self.run
+        run["elapsed"] = time.perf_counter() - run.pop("start")
+        run["events_per_s"] = run["events"] / run["elapsed"] if run["elapsed"] else None
+        run["parse_time"] = {}
+        for port_type, monitors in (("in", inputs), ("out", outputs)):
+            for port, mon in monitors.items():
+                if hasattr(mon, "parse_time"):
+                    run["parse_time"]["%s:%s" % (port_type, port)] = mon.parse_time
+        self.run = None
+
+    def relation_stats(self):
+        stats = {}
+        for name, durations in self.durations.items():
+            stats[name] = {"calls": durations.count, "total": durations.total, "max": durations.max}
+            for p in PERCENTILES:
+                stats[name]["p%d" % p] = durations.percentile(p)
+        return stats
+
+    def report(self):
+        return {"relations": self.relation_stats(), "runs": self.runs}
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self, top=10):
+        """Text report with the relations that took the most time and the throughput of every test case."""
+        stats = sorted(self.relation_stats().items(), key=lambda item: item[1]["total"], reverse=True)
+        lines = ["%-60s %10s %10s %10s %10s" % ("relation", "calls", "total (ms)", "p50 (us)", "p99 (us)")]
+        for name, stat in stats[:top]:
+            lines.append("%-60s %10d %10.3f %10.1f %10.1f" % (name[:60], stat["calls"], 1e3 * stat["total"],
+                                                              1e6 * stat["p50"], 1e6 * stat["p99"]))
+        for run in self.runs:
+            lines.append("%s: %d steps, %d events, %.3f s (%.0f events/s), %.3f s parsing" % (
+                run["tc_id"], run["steps"], run["events"], run["elapsed"], run["events_per_s"] or 0,
+                sum(run["parse_time"].values())))
+        return "\n".join(lines)
@@ -0,0 +1,93 @@
+from collections import namedtuple
+
+BOOL_VALUES = {"0": False, "1": True, "false": False, "true": True, "False": False, "True": True}
+
+
+def parse_bool(text):
+    try:
+        return BOOL_VALUES[text]
+    except KeyError:
+        raise ValueError("invalid bool value: %r" % text)
+
+
+SCALARS = {"bool": parse_bool, "int": int, "float": float, "str": str}
+
+
+class PortSchema:
+    """Declared type of the values of a port, which are parsed once when the port file is read.
+
+    kind is one of "bool", "int", "float", "str", "enum" (values are the allowed labels, kept as str) or "record"
+    (fields maps the names of the space separated values of each line to their scalar kind, and every line is
+    parsed to a namedtuple).
+    """
+
+    def __init__(self, kind, values=None, fields=None):
+        self.kind = kind
+        self.values = None
+        self.fields = None
+
+        if kind in SCALARS:
+            self.parse = SCALARS[kind]
+        elif kind == "enum":
+            self.values = list(values)
+            self.labels = {value: value for value in self.values}  # Shared str objects
+            self.parse = self.parse_enum
+        elif kind == "record":
+            self.fields = dict(fields)
+            for field_kind in self.fields.values():
+                if field_kind not in SCALARS:
+                    raise ValueError("unsupported field kind: %r" % (field_kind,))
+            self.record = namedtuple("Record", list(self.fields), rename=True)
+            self.field_parsers = [SCALARS[field_kind] for field_kind in self.fields.values()]
+            self.parse = self.parse_record
+        else:
+            raise ValueError("unsupported port kind: %r" % (kind,))
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Schema from its short form in the port maps: a kind name, a list of enum labels or a dict of fields."""
+        if isinstance(spec, PortSchema):
+            return spec
+        elif isinstance(spec, str):
+            return cls(spec)
+        elif isinstance(spec, (list, tuple)):
+            return cls("enum", values=spec)
+        elif isinstance(spec, dict):
+            return cls("record", fields=spec)
+        raise ValueError("invalid port schema: %r" % (spec,))
+
+    def spec(self):
+        # JSON-serializable description (e.g. to key caches on it)
+        if self.kind == "enum":
+            return self.values
+        elif self.kind == "record":
+            return self.fields
+        return self.kind
+
+    def parse_enum(self, text):
+        try:
+            return self.labels[text]
+        except KeyError:
+            raise ValueError("invalid value %r, expected one of %s" % (text, ", ".join(self.values)))
+
+    def parse_record(self, text):
+        values = text.split()
+        if len(values) != len(self.field_parsers):
+            raise ValueError("expected %d values, got %r" % (len(self.field_parsers), text))
+        return self.record._make([parse(value) for parse, value in zip(self.field_parsers, values)])
+
+    def parse_values(self, texts):
+        parse = self.parse
+        return [None if text is None else parse(text) for text in texts]
+
+    def restore(self, value):
+        # Value read back from JSON (e.g. the levels of a trace cache)
+        return self.record._make(value) if self.kind == "record" and value is not None else value
+
+
+def port_file(entry):
+    """(file name, PortSchema or None) of an entry of the INPUTS/OUTPUTS maps: a file name or (file name, schema)."""
+    if isinstance(entry, str):
+        return entry, None
+    filename, spec = entry
+    return filename, PortSchema.from_spec(spec)
@@ -0,0 +1,96 @@
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from inspect import signature
+
+from campaign import CampaignReport, run_test_case
+from temporal import OPERATORS
+from testing import close_monitors, simulation_end_time
+from time_index import last_time
+
+REGEX_OPERATOR = re.compile(r"\b(%s)\s*\(" % "|".join(OPERATORS))
+
+
+class ShardedReport(CampaignReport):
+    """CampaignReport of the shards of a test case, in time order, followed by its serial part (if any)."""
+
+    @property
+    def violations(self):
+        # First violation of every shard that failed, in simulation time order
+        return sorted(self.failed, key=lambda result: result.sim_time)
+
+
+def has_temporal_rules(relations_fn):
+    with open(relations_fn, "r") as f:
+        return any(REGEX_OPERATOR.search(line) for line in f if not line.strip().startswith("#"))
+
+
+def time_bounds(handler, input_path, output_path):
+    """(first, last) time of the steps of a test case, or None if it has none."""
+    inputs, outputs = handler.open_monitors(input_path, output_path, time_index=handler.time_index)
+    try:
+        monitors = list(inputs.values()) + list(outputs.values())
+        first_times = [mon.next_time for mon in monitors if mon.next_time is not None]
+        last = simulation_end_time({port_type: [last_time(mon) for mon in ports.values() if mon.next_time is not None]
+                                    for port_type, ports in (("in", inputs), ("out", outputs))})
+    finally:
+        close_monitors(inputs, outputs)
+    if last is None:
+        return None
+    return min(first_times), last
+
+
+def run_test_case_sharded(handler, tc_id, input_path, output_path, relations_fun=None, relations_fn=None,
+                          shards=None, workers=None, stateful="serial"):
+    """Checks a test case split in shards of simulation time, on a pool of worker processes. Returns a ShardedReport.
+
+    Each shard runs as a window of the test case (see MetamorphicTestingHandler.run_test_case), so its monitors
+    start from their state at its first time, by seeking with time indexes (time_index=True) or by scanning.
+    Relations with state across steps (functions with a mem or temporal argument, rules files with temporal
+    operators) cannot be split: with stateful="serial" they are checked over the whole test case by one more
+    worker, and with stateful="reject" a ValueError is raised. Relation functions must be picklable.
+    """
+    if stateful not in ("serial", "reject"):
+        raise ValueError("stateful must be 'serial' or 'reject'")
+
+    start = time.perf_counter()
+    relations_fun = relations_fun or {}
+    stateful_fun = {name: fun for name, fun in relations_fun.items() if len(signature(fun).parameters) == 3}
+    stateless_fun = {name: fun for name, fun in relations_fun.items() if name not in stateful_fun}
+    stateful_fn = relations_fn if relations_fn is not None and has_temporal_rules(relations_fn) else None
+    stateless_fn = relations_fn if stateful_fn is None else None
+
+    if stateful == "reject" and (stateful_fun or stateful_fn):
+        names = list(stateful_fun) + ([stateful_fn] if stateful_fn else [])
+        raise ValueError("Relations with state across steps cannot be checked in shards: %s" % ", ".join(names))
+
+    workers = workers or os.cpu_count() or 1
+    shards = shards or workers
+    config = handler.worker_config()
+    config["verbose"] = False
+
+    jobs = []
+    if stateless_fun or stateless_fn:
+        bounds = time_bounds(handler, input_path, output_path)
+        if bounds is None:
+            windows = [(None, None)]
+        else:
+            first, last = bounds
+            # Shard k checks the steps in [cuts[k], cuts[k + 1]) (the last one up to the end)
+            cuts = sorted({first + (last - first + 1) * k // shards for k in range(shards)})
+            windows = [(cut, next_cut - 1) for cut, next_cut in zip(cuts, cuts[1:])] + [(cuts[-1], None)]
+        jobs += [(config, "%s[%d]" % (tc_id, k), input_path, output_path, stateless_fun or None, stateless_fn, False,
+                  t_start, t_end) for k, (t_start, t_end) in enumerate(windows)]
+    if stateful_fun or stateful_fn:
+        jobs.append((config, "%s[serial]" % tc_id, input_path, output_path, stateful_fun or None, stateful_fn, False,
+                     None, None))
+
+    workers = min(workers, max(len(jobs), 1))
+    if workers == 1:
+        results = [run_test_case(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_test_case, *zip(*jobs)))
+
+    return ShardedReport(results, time.perf_counter() - start, workers)
@@ -0,0 +1,236 @@
+import asyncio
+import heapq
+import threading
+from collections import deque
+
+from multiplexed import port_events
+from testing import parse_value, simulation_end_time
+
+BLOCK_SIZE = 1 << 16  # Bytes read from the socket at once
+MAX_BATCHES = 64  # Batches of events buffered before the socket stops being read
+
+
+class PortState:
+    """Current state of a port fed by a StreamScheduler. Relations read it as a StatesMonitor."""
+
+    def __init__(self):
+        self.curr_time = None
+        self.curr_state = None
+
+
+class StreamScheduler:
+    """Scheduler of a test case (as EventScheduler) over a time-sorted stream of events of all the ports.
+
+    batches is an iterable of lists of (port_type, port, time, state). The events at the same time are a step, and
+    the simulation ends with the stream.
+    """
+
+    def __init__(self, batches, inputs: dict, outputs: dict):
+        self.batches = iter(batches)
+        self.monitors = {"in": inputs, "out": outputs}
+        self.events = deque()
+
+    def peek(self):
+        while not self.events:
+            batch = next(self.batches, None)
+            if batch is None:
+                return None
+            self.events.extend(batch)
+        return self.events[0]
+
+    def next_time(self):
+        event = self.peek()
+        return None if event is None else event[2]
+
+    def advance(self, sim_time):
+        changed = {}
+        event = self.peek()
+        while event is not None and event[2] == sim_time:
+            port_type, port, _, state = self.events.popleft()
+            try:
+                mon = self.monitors[port_type][port]
+            except KeyError:
+                raise RuntimeError("Event of an unknown port: %s:%s" % (port_type, port))
+
+            # As in the port files, the last state of a port at the same time wins
+            mon.curr_time = sim_time
+            mon.curr_state = state
+            changed[(port_type, port)] = None
+            event = self.peek()
+
+        if event is not None and event[2] < sim_time:
+            raise RuntimeError("Events out of order: %s:%s at %d after %d" % (event[0], event[1], event[2], sim_time))
+
+        return list(changed)
+
+
+class SocketEventSource:
+    """Receives the port events of a running simulator over a local socket: TCP for a (host, port) address, UNIX
+    for a path.
+
+    The simulator connects once and sends lines "<in|out>:<port> <time_ms> <value>", sorted by time, closing the
+    connection at the end. An asyncio server parses each chunk read into a batch of events, and iterating over the
+    source yields these batches. At most max_batches are buffered: past that the socket is not read until the
+    checks catch up, so the simulator blocks on its writes. Values of the ports in schemas ({(port_type, port):
+    PortSchema}) are parsed with their schema.
+    """
+
+    def __init__(self, address, multival=False, max_batches=MAX_BATCHES, schemas=None):
+        self.address = address
+        self.multival = multival
+        self.max_batches = max_batches
+        self.schemas = schemas or {}
+
+        self.loop = None
+        self.queue = None
+        self.server = None
+        self.thread = None
+        self.connection = None  # Task serving the simulator, and its writer
+        self.writer = None
+
+    def start(self):
+        ready = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self.loop.run_until_complete(self.serve())
+            except Exception as e:
+                errors.append(e)
+                ready.set()
+                return
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name="mmpy-socket", daemon=True)
+        self.thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+        return self
+
+    async def serve(self):
+        self.queue = asyncio.Queue(self.max_batches)
+        if isinstance(self.address, tuple):
+            host, port = self.address
+            self.server = await asyncio.start_server(self.handle, host, port)
+        else:
+            self.server = await asyncio.start_unix_server(self.handle, self.address)
+
+    async def handle(self, reader, writer):
+        # Only one simulator is served
+        self.server.close()
+        self.connection = asyncio.current_task()
+        self.writer = writer
+        pending = b""
+        try:
+            while True:
+                data = await reader.read(BLOCK_SIZE)
+                if not data:
+                    break
+
+                data = pending + data
+                line_end = data.rfind(b"\n") + 1
+                pending = data[line_end:]
+                if line_end:
+                    await self.queue.put(self.parse_events(data[:line_end].decode()))
+
+            if pending.strip():
+                await self.queue.put(self.parse_events(pending.decode()))
+            await self.queue.put(None)
+        except asyncio.CancelledError:
+            pass  # Stopped by close()
+        except Exception as e:
+            await self.queue.put(e)
+        finally:
+            writer.close()
+
+    def parse_events(self, text):
+        events = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                port_ref, event_time, value = line.split(" ", 2)
+                port_type, port = port_ref.split(":", 1)
+                schema = self.schemas.get((port_type, port))
+                value = parse_value(value.strip(), self.multival) if schema is None else schema.parse(value.strip())
+                events.append((port_type, port, int(event_time), value))
+            except ValueError:
+                raise RuntimeError("Malformed event: %r" % line)
+        return events
+
+    def __iter__(self):
+        while True:
+            batch = asyncio.run_coroutine_threadsafe(self.queue.get(), self.loop).result()
+            if batch is None:
+                return
+            elif isinstance(batch, Exception):
+                raise batch
+            yield batch
+
+    def close(self):
+        if self.loop is None:
+            return
+
+        async def shutdown():
+            # If the checks stopped early (e.g. a relation failed), the simulator may be blocked on its writes: the
+            # connection is closed so that it sees it instead of waiting forever
+            self.server.close()
+            if self.connection is not None and not self.connection.done():
+                self.connection.cancel()
+                await self.connection
+            if self.writer is not None:
+                self.writer.close()
+                try:
+                    await self.writer.wait_closed()
+                except (ConnectionError, OSError):
+                    pass
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+async def replay(address, port_files, chunk_lines=4096):
+    """Stand-in simulator: sends the events of existing port files over the socket, merged in time order.
+
+    port_files maps (port_type, port) to the path of its file. The files are read as by StatesMonitor (see
+    multiplexed.port_events), and the events stop at the last step of the test case (see simulation_end_time).
+    """
+    streams = {key: list(port_events(path, "%s:%s" % key)) for key, path in port_files.items()}
+    end_time = simulation_end_time({port_type: [events[-1][0] for (p_type, _), events in streams.items()
+                                                if p_type == port_type and events] for port_type in ("in", "out")})
+
+    if isinstance(address, tuple):
+        reader, writer = await asyncio.open_connection(*address)
+    else:
+        reader, writer = await asyncio.open_unix_connection(address)
+
+    merged = heapq.merge(*streams.values(), key=lambda event: event[0])
+    lines = []
+    for event_time, port_ref, value in merged:
+        if end_time is None or event_time > end_time:
+            break
+
+        lines.append("%s %d %s\n" % (port_ref, event_time, value))
+        if len(lines) == chunk_lines:
+            writer.write("".join(lines).encode())
+            await writer.drain()  # Waits while the checks are behind
+            lines = []
+
+    writer.write("".join(lines).encode())
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
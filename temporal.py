@@ -0,0 +1,196 @@
+import ast
+from collections import deque
+
+
+class Prev:
+    """Value of the previous step."""
+
+    def __init__(self):
+        self.last = None
+
+    def update(self, sim_time, value):
+        result = self.last
+        self.last = value
+        return result
+
+
+class Held:
+    """True if the condition has been true for at least duration ms."""
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.since = None
+
+    def update(self, sim_time, cond):
+        if not cond:
+            self.since = None
+        elif self.since is None:
+            self.since = sim_time
+        return self.since is not None and sim_time - self.since >= self.duration
+
+
+class Within:
+    """True if the condition has been true at some moment of the last duration ms."""
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.last = None  # Last time the condition was true
+        self.holding = False
+
+    def update(self, sim_time, cond):
+        # A condition true at the previous step was true until now
+        if cond or self.holding:
+            self.last = sim_time
+        self.holding = bool(cond)
+        return self.last is not None and sim_time - self.last <= self.duration
+
+
+class _Window:
+    """Values of the steps of the last duration ms: a step is in the window until duration ms after the next one.
+    None values are left out."""
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.entries = deque()  # [value, end time], the end is None for the current step
+        self.current = None
+
+    def push(self, sim_time, value):
+        if self.current is not None:
+            self.current[1] = sim_time
+        self.current = None if value is None else [value, None]
+
+    def expire(self, sim_time):
+        entries = self.entries
+        while entries and entries[0][1] is not None and entries[0][1] <= sim_time - self.duration:
+            self.pop_front(entries.popleft())
+
+    def pop_front(self, entry):
+        pass
+
+
+class WindowMin(_Window):
+    """Minimum over the last duration ms, with a monotonic deque."""
+
+    def better(self, a, b):
+        return a <= b
+
+    def update(self, sim_time, value):
+        self.push(sim_time, value)
+        if self.current is not None:
+            # Values not better than the new one can never be the result again
+            while self.entries and self.better(value, self.entries[-1][0]):
+                self.entries.pop()
+            self.entries.append(self.current)
+        self.expire(sim_time)
+        return self.entries[0][0] if self.entries else None
+
+
+class WindowMax(WindowMin):
+    """Maximum over the last duration ms, with a monotonic deque."""
+
+    def better(self, a, b):
+        return a >= b
+
+
+class WindowMean(_Window):
+    """Mean of the values of the steps in the last duration ms, with a running sum."""
+
+    def __init__(self, duration):
+        super().__init__(duration)
+        self.total = 0
+
+    def update(self, sim_time, value):
+        self.push(sim_time, value)
+        if self.current is not None:
+            self.entries.append(self.current)
+            self.total += value
+        self.expire(sim_time)
+        return self.total / len(self.entries) if self.entries else None
+
+    def pop_front(self, entry):
+        self.total -= entry[0]
+
+
+# Name in the rules files -> (class, number of arguments). The first argument is evaluated at every step, the
+# others are constant durations (ms).
+OPERATORS = {"prev": (Prev, 1),
+             "held": (Held, 2),
+             "within": (Within, 2),
+             "window_min": (WindowMin, 2),
+             "window_max": (WindowMax, 2),
+             "window_mean": (WindowMean, 2)}
+
+
+class TemporalContext:
+    """Temporal operators for relation functions that take a third argument named temporal.
+
+    Each operator is identified by a key, and every call gives it the value of the current step, e.g.
+    temporal.held("alarm_on", outputs["alarm"].curr_state == 1, 5000). They must be called at every step (not
+    inside a branch) to see every value.
+    """
+
+    def __init__(self):
+        self.sim_time = None
+        self.operators = {}
+
+    def update(self, op_class, key, value, *args):
+        op = self.operators.get(key)
+        if op is None:
+            op = self.operators[key] = op_class(*args)
+        return op.update(self.sim_time, value)
+
+    def prev(self, key, value):
+        return self.update(Prev, key, value)
+
+    def held(self, key, cond, duration):
+        return self.update(Held, key, cond, duration)
+
+    def within(self, key, cond, duration):
+        return self.update(Within, key, cond, duration)
+
+    def window_min(self, key, value, duration):
+        return self.update(WindowMin, key, value, duration)
+
+    def window_max(self, key, value, duration):
+        return self.update(WindowMax, key, value, duration)
+
+    def window_mean(self, key, value, duration):
+        return self.update(WindowMean, key, value, duration)
+
+
+class OperatorHoister(ast.NodeTransformer):
+    """Takes the temporal operators out of a rule expression, so that they can be updated at every step even where
+    the rule is not evaluated (e.g. after a false pre condition or inside and/or).
+
+    Each call is replaced by the read of the value of its operator, _ops[i].value, and the operator is appended to
+    ops with the function of its first argument (compiled with compile_arg) in op.arg. Nested operators are
+    appended before the ones using them.
+    """
+
+    def __init__(self, ops, compile_arg):
+        self.ops = ops
+        self.compile_arg = compile_arg
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.func, ast.Name) or node.func.id not in OPERATORS:
+            return node
+
+        name = node.func.id
+        op_class, n_args = OPERATORS[name]
+        if len(node.args) != n_args or node.keywords:
+            raise SyntaxError("%s() takes %d arguments" % (name, n_args))
+        try:
+            params = [ast.literal_eval(arg) for arg in node.args[1:]]
+        except ValueError:
+            raise SyntaxError("the duration of %s() must be a number of ms" % name)
+
+        op = op_class(*params)
+        op.arg = self.compile_arg(node.args[0])
+        op.value = None
+        self.ops.append(op)
+
+        value = ast.Attribute(value=ast.Subscript(value=ast.Name(id="_ops", ctx=ast.Load()),
+                                                  slice=ast.Constant(value=len(self.ops) - 1), ctx=ast.Load()),
+                              attr="value", ctx=ast.Load())
+        return ast.copy_location(value, node)
@@ -1,19 +1,69 @@
+import ast
 import os
 from abc import ABC, abstractmethod
-import re
 from collections import OrderedDict
+from collections.abc import Mapping
+import heapq
+import re
+import time
+from ast import literal_eval
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from compressed import open_trace
+from schema import port_file
+from temporal import OperatorHoister, TemporalContext
+from time_index import TimeIndex, TimeIndexBuilder
+from trace_store import TraceStore
+from vectorized import align_monitors, compile_vectorized_rule, evaluate_rule
 
-from visualization import Visualizer
 from inspect import signature
 import itertools
 
+if TYPE_CHECKING:
+    # Plotting dependencies are only imported by the visualizers themselves
+    from visualization import Visualizer
+
+def parse_value(state, multival=False):
+    if multival:
+        state = StatesMonitor.REGEX_SPACES.split(state)
+        for i in range(len(state)):
+            if state[i].isnumeric():
+                state[i] = float(state[i])
+    else:
+        if state.isnumeric():
+            state = float(state)
+
+    return state
+
+
 class StatesMonitor:
     REGEX_LINE = r"([0-9]{2}):([0-9]{2}):([0-9]{2})(?::([0-9]{3}))? (.+)"
+    REGEX_SPACES = re.compile(r"\s+")
+    REGEX_NOT_SINGLE_SPACES = re.compile(r"[^\S \n]|  ")  # Whitespace other than single spaces (and line breaks)
+    BLOCK_SIZE = 1 << 20  # Characters read at once
+    FIRST_BLOCK_SIZE = 1 << 16  # Reads start smaller (and double up to BLOCK_SIZE) to get the first states quickly
+
+    DIGIT_COLUMNS = [0, 1, 3, 4, 6, 7]
+    COLON_COLUMNS = [2, 5]
+    MS_DIGIT_COLUMNS = [9, 10, 11]
 
-    def __init__(self, path, multival=False):
-        self.in_stream = open(path, "r")
+    def __init__(self, path, multival=False, schema=None, time_index=False):
+        self.path = path
+        self.in_stream = self.open(path)
         self.finished = False
 
+        # Sparse time index of the file to seek into it (see time_index.py), built by the first full parse. Streams
+        # that cannot seek (compressed files) have none.
+        self.index = None
+        self.index_builder = None
+        if time_index and self.in_stream is not None and self.in_stream.seekable():
+            self.index = TimeIndex.load(path)
+            if self.index is None:
+                self.index_builder = TimeIndexBuilder(self.in_stream.encoding)
+
         self.curr_time = None
         self.curr_state = None
 
@@ -21,9 +71,31 @@ class StatesMonitor:
         self.next_state = None
 
         self.multival = multival
+        self.schema = schema  # PortSchema of the values (see schema.py), None to guess them
+        self.parse_time = 0.0  # Time spent reading and parsing the file (s)
+
+        # Parsed blocks of lines, consumed by advance()
+        self.blocks = self.read_blocks()
+        self.entries = iter(())
 
         self.advance()
 
+    def open(self, path):
+        # Compressed files (.gz, .xz, .zst) are decompressed while they are read
+        return open_trace(path)
+
+    def close(self):
+        # Releases the file: no more states can be read
+        self.blocks.close()
+        if self.in_stream is not None:
+            self.in_stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def advance(self):
         if self.finished:
             return
@@ -32,10 +104,12 @@ class StatesMonitor:
         self.curr_state = self.next_state
 
         while not self.finished and self.curr_time == self.next_time:
-            line = self.in_stream.readline()
+            entry = next(self.entries, None)
+            if entry is None:
+                entry = self.read_block()
 
-            if line:
-                self.next_time, self.next_state = self.parse_state(line.strip())
+            if entry is not None:
+                self.next_time, self.next_state = entry
 
                 if self.curr_time == self.next_time:
                     self.curr_state = self.next_state
@@ -44,6 +118,148 @@ class StatesMonitor:
                 self.next_time = None
                 self.next_state = None
 
+    def read_block(self):
+        # Returns the first (time, state) entry of the next block, or None at the end of the file
+        start = time.perf_counter()
+        try:
+            for times, states in self.blocks:
+                self.entries = zip(times, states)
+                return next(self.entries)
+            return None
+        finally:
+            self.parse_time += time.perf_counter() - start
+
+    def read_blocks(self):
+        # Generator of (times, states) with the lines of each block read from the file (never empty).
+        # The last line of the file may lack the line break.
+        pending_text = ""
+        size = StatesMonitor.FIRST_BLOCK_SIZE
+        while True:
+            text = self.read_text(size)
+            size = min(2 * size, StatesMonitor.BLOCK_SIZE)
+            if not text:
+                if pending_text:
+                    yield self.parse_block(pending_text)
+                self.save_index()
+                return
+
+            text = pending_text + text
+            line_end = text.rfind("\n") + 1
+            pending_text = text[line_end:]
+            if line_end:
+                yield self.parse_block(text[:line_end - 1])
+
+    def parse_block(self, text):
+        block = self.parse_states(text)
+        if self.index_builder is not None:
+            self.index_builder.add_block(text, block[0])
+        return block
+
+    def save_index(self):
+        builder, self.index_builder = self.index_builder, None
+        # Universal newlines hide "\r\n" line breaks, which would make the byte offsets wrong
+        if builder is not None and self.in_stream.newlines in (None, "\n"):
+            self.index = builder.build()
+            self.index.save(self.path)
+
+    def complete_index(self):
+        # Parses the rest of the file (if the test case ended before it) so that its index gets written
+        if self.index_builder is not None:
+            for _ in self.blocks:
+                pass
+
+    def seek(self, sim_time):
+        """Moves to the state of the port at sim_time: curr_state is the last state up to sim_time and next_time
+        the time of the following one. With a time index it jumps close to it instead of reading from the start."""
+        if self.index is not None and self.in_stream.seekable():
+            self.jump(self.index.seek_offset(sim_time))
+        self.skip_to(sim_time)
+
+    def jump(self, offset):
+        # Restarts reading at the line starting at byte offset
+        self.index_builder = None
+        self.in_stream.seek(offset)
+        self.blocks = self.read_blocks()
+        self.entries = iter(())
+        self.finished = False
+        self.next_time = None
+        self.next_state = None
+        self.advance()
+
+    def skip_to(self, sim_time):
+        while self.next_time is not None and self.next_time <= sim_time:
+            self.advance()
+
+    def read_text(self, size=BLOCK_SIZE):
+        # Next chunk of the file, empty at the end
+        return self.in_stream.read(size)
+
+    def parse_states(self, text):
+        """Parses several lines at once. Returns a list of times and a list of states (None for malformed lines).
+
+        Times of well-formed lines ("HH:MM:SS[:mmm] value", without surrounding whitespace) are computed with
+        NumPy for the whole block. Any other line goes through parse_state, so the results are the same.
+        """
+        lines = text.split("\n")
+        n_lines = len(lines)
+
+        lengths = np.fromiter(map(len, lines), dtype=np.int64, count=n_lines)
+        starts = np.zeros(n_lines, dtype=np.int64)
+        np.cumsum(lengths[:-1] + 1, out=starts[1:])
+
+        if text.isascii():
+            chars = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+        else:
+            chars = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        chars = np.concatenate((chars, np.zeros(16, dtype=chars.dtype)))
+
+        head = chars[starts[:, None] + np.arange(13)].astype(np.int64)
+        last = chars[np.maximum(starts + lengths - 1, 0)]
+        digits = head - ord("0")
+        is_digit = (digits >= 0) & (digits <= 9)
+
+        valid = (lengths >= 10) & (last > ord(" ")) & (last < 0x80) & \
+                is_digit[:, StatesMonitor.DIGIT_COLUMNS].all(axis=1) & \
+                (head[:, StatesMonitor.COLON_COLUMNS] == ord(":")).all(axis=1)
+        no_ms = valid & (head[:, 8] == ord(" "))
+        with_ms = valid & (head[:, 8] == ord(":")) & (lengths >= 14) & (head[:, 12] == ord(" ")) & \
+                  is_digit[:, StatesMonitor.MS_DIGIT_COLUMNS].all(axis=1)
+
+        state_times = 3600000 * (10 * digits[:, 0] + digits[:, 1]) + 60000 * (10 * digits[:, 3] + digits[:, 4]) + \
+                      1000 * (10 * digits[:, 6] + digits[:, 7])
+        state_times += np.where(with_ms, 100 * digits[:, 9] + 10 * digits[:, 10] + digits[:, 11], 0)
+        offsets = np.where(with_ms, 13, 9).tolist()
+
+        well_formed = no_ms | with_ms
+        times = state_times.tolist()
+        parse_value = self.parse_value
+        if self.schema is not None:
+            try:
+                states = self.schema.parse_values([line[offset:] if ok else None
+                                                   for line, offset, ok in zip(lines, offsets, well_formed.tolist())])
+            except ValueError as e:
+                raise ValueError("%s: %s" % (self.path, e))
+        elif self.multival and StatesMonitor.REGEX_NOT_SINGLE_SPACES.search(text) is None:
+            # Values are separated by single spaces, so str.split gives the same result as REGEX_SPACES.split
+            states = [[float(value) if value.isnumeric() else value for value in line[offset:].split(" ")]
+                      if ok else None for line, offset, ok in zip(lines, offsets, well_formed.tolist())]
+        else:
+            states = [parse_value(line[offset:]) if ok else None
+                      for line, offset, ok in zip(lines, offsets, well_formed.tolist())]
+
+        for i in np.flatnonzero(~well_formed).tolist():
+            times[i], states[i] = self.parse_state(lines[i].strip())
+
+        return times, states
+
+    def parse_value(self, state):
+        if self.schema is not None:
+            try:
+                return self.schema.parse(state)
+            except ValueError as e:
+                raise ValueError("%s: %s" % (self.path, e))
+        return parse_value(state, self.multival)
+
     def parse_state(self, line):
         match = re.match(StatesMonitor.REGEX_LINE, line)
 
@@ -56,85 +272,512 @@ class StatesMonitor:
         if nanoseconds is not None:
             state_time += int(nanoseconds)
 
-        if self.multival:
-            state = re.split("\s+", state)
-            for i in range(len(state)):
-                if state[i].isnumeric():
-                    state[i] = float(state[i])
+        return int(state_time), self.parse_value(state)
+
+
+class FollowStatesMonitor(StatesMonitor):
+    """StatesMonitor of a port file that is still being written by the simulation (as tail -f).
+
+    Reads never block: at the end of the lines written so far (or if the file does not exist yet) the monitor waits,
+    with next_time None while it is not finished, and poll() reads the lines written since. It only finishes once
+    is_done() returns True (e.g. the simulation process has exited) and the file is read to its end, or when no data
+    has arrived for timeout seconds (None waits forever). FollowScheduler polls the monitors of a test case.
+    """
+
+    NO_LINES = ([], [])  # Block of read_blocks when no complete line has been written since the last read
+
+    def __init__(self, path, multival=False, schema=None, timeout=None, is_done=None):
+        self.timeout = timeout
+        self.is_done = is_done
+        self.last_time = None  # Latest time read from the file
+        self.last_data = time.monotonic()  # When data last arrived
+        super().__init__(path, multival, schema)
+
+    def open(self, path):
+        # The file is opened by read_text once it exists
+        try:
+            return super().open(path)
+        except FileNotFoundError:
+            return None
+
+    def read_text(self, size=StatesMonitor.BLOCK_SIZE):
+        # Data written since the last read, empty if none
+        if self.in_stream is None:
+            self.in_stream = self.open(self.path)
+            if self.in_stream is None:
+                return ""
+        return self.in_stream.read(size)
+
+    def read_blocks(self):
+        # As StatesMonitor.read_blocks, but yields NO_LINES instead of waiting for more lines. The last line is
+        # only parsed without its line break once the file is complete.
+        pending_text = ""
+        while True:
+            # Checked before reading, so that the data written before the simulation ended is read
+            done = self.is_done is not None and self.is_done()
+            text = self.read_text()
+            if text:
+                self.last_data = time.monotonic()
+                text = pending_text + text
+                line_end = text.rfind("\n") + 1
+                pending_text = text[line_end:]
+                if line_end:
+                    yield self.parse_block(text[:line_end - 1])
+            elif done or (self.timeout is not None and time.monotonic() - self.last_data >= self.timeout):
+                if self.in_stream is None:
+                    # The file never appeared: opening it once more raises the error
+                    super().open(self.path)
+                if pending_text:
+                    yield self.parse_block(pending_text)
+                return
+            else:
+                yield FollowStatesMonitor.NO_LINES
+
+    def advance(self):
+        # Only called with next_time known (or at the start), as it moves to it
+        if self.finished:
+            return
+
+        self.curr_time = self.next_time
+        self.curr_state = self.next_state
+        self.next_time = None
+        self.next_state = None
+        self.poll()
+
+    def poll(self):
+        """Reads the lines written since the last call, without waiting, until the first one after curr_time.
+        Returns True if next_time is known or the monitor finished."""
+        start = time.perf_counter()
+        try:
+            while self.next_time is None and not self.finished:
+                entry = next(self.entries, None)
+                if entry is None:
+                    block = next(self.blocks, None)
+                    if block is None:
+                        self.finished = True
+                    elif block is FollowStatesMonitor.NO_LINES:
+                        return False
+                    else:
+                        self.add_block(block)
+                    continue
+
+                state_time, state = entry
+                if state_time is None:
+                    # As in StatesMonitor.advance, a malformed line ends the port, unless it comes first
+                    if self.curr_time is not None:
+                        self.finished = True
+                elif state_time == self.curr_time:
+                    # The last state of a port at the same time wins
+                    self.curr_state = state
+                else:
+                    self.next_time = state_time
+                    self.next_state = state
+            return True
+        finally:
+            self.parse_time += time.perf_counter() - start
+
+    def read_ahead(self):
+        # Reads the lines written since the last read after the entries not consumed yet, updating last_time
+        if not self.finished:
+            block = next(self.blocks, None)
+            if block is not None and block is not FollowStatesMonitor.NO_LINES:
+                self.add_block(block)
+
+    def add_block(self, block):
+        times, _ = block
+        self.entries = itertools.chain(self.entries, zip(*block))
+        self.last_time = next((state_time for state_time in reversed(times) if state_time is not None), self.last_time)
+
+
+def close_monitors(*port_maps):
+    # Closes the monitors of dicts of ports (e.g. inputs and outputs), even if some of them fail to close
+    errors = []
+    for mon in itertools.chain.from_iterable(ports.values() for ports in port_maps):
+        try:
+            mon.close()
+        except Exception as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
+
+
+def simulation_end_time(last_times):
+    """Time of the last step of a test case, from the times of the last states of its ports ({"in": [...], "out":
+    [...]}, for the ports that have states): the simulation ends as soon as all the inputs or all the outputs are
+    exhausted, as in EventScheduler. None if it has no steps.
+
+    The last times follow the monitors, e.g. time_index.last_time or the times of read_monitor (vectorized.py).
+    """
+    if not last_times["in"] or not last_times["out"]:
+        return None
+    return min(max(last_times["in"]), max(last_times["out"]))
+
+
+class EventScheduler:
+    """Priority queue (k-way merge) of the monitors of a test case, keyed on their next event time."""
+
+    def __init__(self, inputs: dict, outputs: dict):
+        self.queue = []
+        self.counter = itertools.count()
+        self.pending = {"in": 0, "out": 0}  # Monitors with events left, per port type
+
+        for port_type, monitors in (("in", inputs), ("out", outputs)):
+            for port, mon in monitors.items():
+                self.push(port_type, port, mon)
+
+    def push(self, port_type, port, mon):
+        if mon.next_time is not None:
+            heapq.heappush(self.queue, (mon.next_time, next(self.counter), port_type, port, mon))
+            self.pending[port_type] += 1
+
+    def next_time(self):
+        # The simulation ends as soon as either all the inputs or all the outputs are exhausted
+        if not self.pending["in"] or not self.pending["out"]:
+            return None
+
+        return self.queue[0][0]
+
+    def advance(self, sim_time):
+        changed = []
+        while self.queue and self.queue[0][0] == sim_time:
+            _, _, port_type, port, mon = heapq.heappop(self.queue)
+            self.pending[port_type] -= 1
+            mon.advance()
+            changed.append((port_type, port, mon))
+
+        for port_type, port, mon in changed:
+            self.push(port_type, port, mon)
+
+        return [(port_type, port) for port_type, port, _ in changed]
+
+
+class FollowScheduler(EventScheduler):
+    """EventScheduler of the FollowStatesMonitor of a running simulation, releasing its steps as they are written.
+
+    It relies on the simulation writing its events in time order across all its port files: once any file holds a
+    line at time t, every file holds all its lines before t. So a step is checked as soon as it is before the
+    watermark, the latest time read from any file, or at most the time returned by progress() (if given), up to
+    which the simulation reports that all its events are written. Monitors with no new lines are only waited for
+    (polling them every poll_interval seconds at most) while the next step is not released, or until they finish.
+    """
+
+    def __init__(self, inputs: dict, outputs: dict, poll_interval=0.1, progress=None):
+        self.waiting = []  # (port_type, port, mon) of the monitors whose next event is not written yet
+        self.poll_interval = poll_interval
+        self.progress = progress
+        self.monitors = list(inputs.values()) + list(outputs.values())
+        self.watermark = None
+        super().__init__(inputs, outputs)
+
+    def push(self, port_type, port, mon):
+        if mon.next_time is None and not mon.finished:
+            self.waiting.append((port_type, port, mon))
+            self.pending[port_type] += 1
         else:
-            if state.isnumeric():
-                state = float(state)
+            super().push(port_type, port, mon)
+
+    def poll_waiting(self):
+        waiting, self.waiting = self.waiting, []
+        for port_type, port, mon in waiting:
+            mon.poll()
+            self.pending[port_type] -= 1
+            self.push(port_type, port, mon)
+
+    def released(self, sim_time):
+        if self.watermark is not None and sim_time < self.watermark:
+            return True
+        for mon in self.monitors:
+            mon.read_ahead()
+        self.watermark = max((mon.last_time for mon in self.monitors if mon.last_time is not None), default=None)
+        if self.watermark is not None and sim_time < self.watermark:
+            return True
+        progress = self.progress() if self.progress is not None else None
+        return progress is not None and sim_time <= progress
+
+    def next_time(self):
+        delay = self.poll_interval / 16
+        while True:
+            self.poll_waiting()
+            # The simulation ends as soon as either all the inputs or all the outputs are exhausted
+            if not self.pending["in"] or not self.pending["out"]:
+                return None
+            if self.queue and (not self.waiting or self.released(self.queue[0][0])):
+                return self.queue[0][0]
+
+            time.sleep(delay)
+            delay = min(2 * delay, self.poll_interval)
+
+
+class RecordingPorts(Mapping):
+    """Read-only view of a dict of monitors that records the ports read through it (all of them if iterated)."""
+
+    def __init__(self, port_type, monitors, reads):
+        self.port_type = port_type
+        self.monitors = monitors
+        self.reads = reads
+
+    def __getitem__(self, port):
+        if port in self.monitors:
+            self.reads.add((self.port_type, port))
+        return self.monitors[port]
+
+    def __iter__(self):
+        self.reads.update((self.port_type, port) for port in self.monitors)
+        return iter(self.monitors)
+
+    def __len__(self):
+        return len(self.monitors)
+
+
+def pure_relation(fun=None, maxsize=4096):
+    """Decorator of relation functions whose outcome only depends on the states of the ports they read.
+
+    Their pass/fail outcome is memoized on these states (see MemoizedRelation). Used as @pure_relation or
+    @pure_relation(maxsize=...). Relations taking the mem argument are never memoized.
+    """
+    def mark(fun):
+        fun.memo_size = maxsize
+        return fun
+
+    return mark(fun) if fun is not None else mark
+
+
+def _hashable_state(state):
+    return tuple(state) if isinstance(state, list) else state
+
+
+class MemoizedRelation:
+    """Bounded LRU cache of the outcomes of a pure relation, keyed on the states of the ports it reads.
+
+    The ports are found by recording the reads of each call. When a call reads a new port (e.g. in a branch not
+    taken before), the key gets longer and the cache is cleared.
+    """
 
-        return int(state_time), state
+    def __init__(self, fun, maxsize):
+        self.fun = fun
+        self.maxsize = maxsize
+        self.ports = []  # (port_type, port) read by the relation so far
+        self.outcomes = OrderedDict()  # key -> None if passed, the AssertionError raised otherwise
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, inputs, outputs):
+        try:
+            key = tuple(_hashable_state((inputs if port_type == "in" else outputs)[port].curr_state)
+                        for port_type, port in self.ports)
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def __call__(self, inputs, outputs):
+        key = self.key(inputs, outputs)
+        if key is not None and key in self.outcomes:
+            self.hits += 1
+            self.outcomes.move_to_end(key)
+            error = self.outcomes[key]
+            if error is not None:
+                raise error
+            return
+
+        self.misses += 1
+        reads = set()
+        error = None
+        try:
+            self.fun(RecordingPorts("in", inputs, reads), RecordingPorts("out", outputs, reads))
+        except AssertionError as e:
+            error = e
+
+        new_ports = reads.difference(self.ports)
+        if new_ports:
+            self.ports.extend(sorted(new_ports))
+            self.outcomes.clear()
+            key = self.key(inputs, outputs)
+
+        if key is not None:
+            self.outcomes[key] = error
+            if len(self.outcomes) > self.maxsize:
+                self.outcomes.popitem(last=False)
+
+        if error is not None:
+            raise error
+
+
+@lru_cache(maxsize=1024)
+def _parse_literal(state):
+    try:
+        return literal_eval(state)
+    except (ValueError, SyntaxError):
+        return state
+
+
+def literal_state(state):
+    # File relations compare states as the literals they were written as (e.g. "3.4" is a number)
+    if isinstance(state, str):
+        return _parse_literal(state)
+    return state
 
 
 class TestingHandler(ABC):
+    REGEX_PORT = r"(in|out):([a-zA-Z0-9_-]+)"
 
-    def __init__(self, visualizer=None):
+    def __init__(self, visualizer=None, spill_dir=None, incremental=False, verbose=True, profile=False):
         self.sim_time = 0
         self.visualizer = visualizer
-        self.port_values = {}
+        self.port_values = {}  # tc_id -> TraceStore
+        self.spill_dir = spill_dir  # If set, port values are stored in memory-mapped files in this folder
+        self.verbose = verbose  # Print the values and the relations checked at every step
+
+        if profile:
+            from profiler import Profiler
+            self.profiler = Profiler()
+        else:
+            self.profiler = None
+
+        # If set, relations are only checked at the steps where some port they depend on has changed
+        self.incremental = incremental
+        self.changed_ports = None  # (port_type, port) advanced in the current step, None to check everything
+        self.relations_deps = {}  # rel_name -> ports read by the last call of the relation function
 
         self.inputs = None
         self.outputs = None
         self.relations = None
+        self.relations_arity = {}
+        self.relations_memo = {}  # rel_name -> MemoizedRelation of the relations marked with @pure_relation
+        self.relations_temporal = {}  # rel_name -> TemporalContext of the relations taking a temporal argument
         self.file_relations = None
+        self.temporal_ops = []  # Temporal operators of the file relations, updated at every step
+        self.file_relations_deps = None
+        self.file_relations_errors = []
+        self.scheduler = None
 
     def get_next_event_time(self):
-        try:
-            min_in = min(mon.next_time for mon in self.inputs.values() if mon.next_time is not None)
-            min_out = min(mon.next_time for mon in self.outputs.values() if mon.next_time is not None)
-            return min(min_in, min_out)
-        except (ValueError, TypeError):
-            return None
+        return self.scheduler.next_time()
 
     def check_func_relations(self):
         if self.relations is None:
             return
 
         for rel_name, rel_fun in self.relations.items():
-            print("Checking %s relation..." % rel_name)
-            has_mem = len(signature(rel_fun).parameters) == 3
+            has_mem = self.relations_arity[rel_name] == 3
 
             if has_mem:
-                mem = self.relations_mem[rel_name] if rel_name in self.relations_mem else {}
-                res = rel_fun(self.inputs, self.outputs, mem)
-                if res is not None:
-                    self.relations_mem[rel_name] = res
+                temporal = self.relations_temporal.get(rel_name)
+                if temporal is not None:
+                    temporal.sim_time = self.sim_time
+                    args = (self.inputs, self.outputs, temporal)
+                else:
+                    mem = self.relations_mem[rel_name] if rel_name in self.relations_mem else {}
+                    args = (self.inputs, self.outputs, mem)
+            elif self.incremental:
+                # The outcome of a stateless relation can only change if some port it read last time has changed
+                deps = self.relations_deps.get(rel_name)
+                if deps is not None and self.changed_ports is not None and deps.isdisjoint(self.changed_ports):
+                    continue
+
+                reads = set()
+                self.relations_deps[rel_name] = reads
+                args = (RecordingPorts("in", self.inputs, reads), RecordingPorts("out", self.outputs, reads))
+            else:
+                args = (self.inputs, self.outputs)
+
+            if not has_mem:
+                rel_fun = self.relations_memo.get(rel_name, rel_fun)
+
+            if self.verbose:
+                print("Checking %s relation..." % rel_name)
+
+            if self.profiler is None:
+                res = rel_fun(*args)
             else:
-                rel_fun(self.inputs, self.outputs)
+                res = self.profiler.time_relation(rel_name, rel_fun, *args)
+
+            if has_mem and res is not None:
+                self.relations_mem[rel_name] = res
 
     def execute_time(self):
-        for port in self.inputs:
-            mon = self.inputs[port]
-            if mon.next_time == self.sim_time:
-                mon.advance()
+        return self.scheduler.advance(self.sim_time)
+
+    def window_start_time(self, t_start):
+        # First step of a run whose monitors were moved to t_start: the first step of the full run at or after
+        # t_start, so that windows check the same steps. None if the simulation had already ended (all the inputs
+        # or all the outputs exhausted before t_start).
+        for monitors in (self.inputs, self.outputs):
+            if not any(mon.next_time is not None or mon.curr_time == t_start for mon in monitors.values()):
+                return None
+        if any(mon.curr_time == t_start for mon in itertools.chain(self.inputs.values(), self.outputs.values())):
+            return t_start
+        return self.get_next_event_time()
+
+    @staticmethod
+    def substitute_ports(rule, port_format, typed_ports=(), typed_format=None):
+        # port_format receives the name of the dict ("inputs" or "outputs") and the name of the port. The ports in
+        # typed_ports ((port_type, port)) use typed_format instead, if given.
+        def port_ref(match):
+            port_type, name = match.groups()
+            typed = typed_format is not None and (port_type, name) in typed_ports
+            return (typed_format if typed else port_format) % ("inputs" if port_type == "in" else "outputs", name)
+
+        return re.sub(TestingHandler.REGEX_PORT, port_ref, rule)
 
-        for port in self.outputs:
-            mon = self.outputs[port]
-            if mon.next_time == self.sim_time:
-                mon.advance()
+    def port_schemas(self):
+        # {(port_type, port): PortSchema} of the ports declared with a schema (see schema.py)
+        return {}
+
+    def compile_rule(self, rule, relations_fn="<rule>"):
+        # States of ports with a schema are already typed, the others are read as literals
+        to_eval = self.substitute_ports(rule, "_state(%s[%r].curr_state)", self.port_schemas(), "%s[%r].curr_state")
+        env = {"_state": literal_state, "_ops": self.temporal_ops}
+
+        def compile_lambda(body):
+            tree = ast.parse("lambda inputs, outputs: None", mode="eval")
+            tree.body.body = body
+            return eval(compile(ast.fix_missing_locations(tree), relations_fn, "eval"), env)
+
+        # Temporal operators (see temporal.py) are taken out of the rule and appended to self.temporal_ops
+        n_ops = len(self.temporal_ops)
+        tree = ast.parse("(%s)" % to_eval, mode="eval")
+        tree = OperatorHoister(self.temporal_ops, compile_lambda).visit(tree)
+        fun = compile_lambda(tree.body)
+        fun.temporal = len(self.temporal_ops) > n_ops
+        return fun
+
+    def update_temporal_ops(self):
+        for op in self.temporal_ops:
+            op.value = op.update(self.sim_time, op.arg(self.inputs, self.outputs))
 
     def parse_file_relations(self, relations_fn):
         relations = []
+        errors = []
+        self.temporal_ops = []
         with open(relations_fn, "r") as rel_file:
-            for line in rel_file.readlines():
+            for line_num, line in enumerate(rel_file.readlines(), 1):
                 line = line.strip()
                 if line != "" and not line.startswith("#"):
-                    print(line)
+                    if self.verbose:
+                        print(line)
                     relation = []
                     line_comps = line.split("->")
-                    for comp in line_comps:
-                        in_dep = []
-                        out_dep = []
-                        for port_type, name in re.findall("(in|out):([a-zA-Z0-9_-]+)", comp):
-                            if port_type == "in":
-                                if name not in in_dep:
-                                    in_dep.append(name)
-                            else:
-                                if name not in out_dep:
-                                    out_dep.append(name)
-                        relation.append(((in_dep, out_dep), comp.strip()))
+                    if len(line_comps) > 2:
+                        errors.append((line_num, line, "more than one '->'"))
+                        continue
+
+                    try:
+                        for comp in line_comps:
+                            in_dep = []
+                            out_dep = []
+                            for port_type, name in re.findall(TestingHandler.REGEX_PORT, comp):
+                                if port_type == "in":
+                                    if name not in in_dep:
+                                        in_dep.append(name)
+                                else:
+                                    if name not in out_dep:
+                                        out_dep.append(name)
+                            comp = comp.strip()
+                            relation.append(((in_dep, out_dep), comp, self.compile_rule(comp, relations_fn)))
+                    except SyntaxError as e:
+                        errors.append((line_num, line, e.msg))
+                        continue
 
                     if len(relation) == 1:
                         relation.insert(0, None)
@@ -142,33 +785,91 @@ class TestingHandler(ABC):
                     relations.append(relation)
 
         self.file_relations = relations
+        self.file_relations_deps = [self.file_relation_deps(pre, post) for pre, post in relations]
+        self.file_relations_errors = errors
+
+        if errors:
+            raise RuntimeError("Some relations could not be compiled (%s):\n%s" % (relations_fn, "\n".join(
+                "  line %d: %s (%s)" % error for error in errors)))
 
     def check_file_relations(self):
-        def rule_accomplished(rule):
-            (in_deps, out_deps), to_eval = rule
-            for in_dep in in_deps:
-                to_eval = to_eval.replace("in:%s" % in_dep, str(self.inputs[in_dep].curr_state))
+        for (pre, post), deps in zip(self.file_relations, self.file_relations_deps):
+            if self.changed_ports is not None and deps is not None and deps.isdisjoint(self.changed_ports):
+                continue
+
+            if self.profiler is None:
+                self.check_file_relation(pre, post)
+            else:
+                name = post[1] if pre is None else "%s -> %s" % (pre[1], post[1])
+                self.profiler.time_relation(name, self.check_file_relation, pre, post)
+
+    def check_file_relation(self, pre, post):
+        if pre is None or pre[2](self.inputs, self.outputs):
+            if not post[2](self.inputs, self.outputs):
+                raise RuntimeError("Rule not accomplished: %s (pre: %s)" % (post[1], pre[1] if pre else None))
+
+    @staticmethod
+    def file_relation_deps(pre, post):
+        # None for the rules with temporal operators, which depend on time too
+        deps = set()
+        for rule in (pre, post):
+            if rule is not None:
+                if rule[2].temporal:
+                    return None
+                in_dep, out_dep = rule[0]
+                deps.update(("in", port) for port in in_dep)
+                deps.update(("out", port) for port in out_dep)
+        return deps
+
+    def check_file_relations_batch(self, inputs: dict, outputs: dict, relations_fn: str):
+        """Checks the rules in relations_fn over whole traces at once instead of step by step.
 
-            for out_dep in out_deps:
-                to_eval = to_eval.replace("out:%s" % out_dep, str(self.outputs[out_dep].curr_state))
+        Returns a list of (pre, post, times) with the violated rules and all the times where they fail.
+        """
+        self.parse_file_relations(relations_fn)
+        if self.temporal_ops:
+            raise RuntimeError("Temporal operators are not supported when checking whole traces (%s)" % relations_fn)
+        timeline, ports = align_monitors(inputs, outputs, literal_state, self.port_schemas())
 
-            return eval(to_eval)
+        def vectorized(rule):
+            if rule is None:
+                return None
+            return compile_vectorized_rule(self.substitute_ports(rule[1], "%s[%r]"), relations_fn)
 
+        violations = []
         for pre, post in self.file_relations:
-            if pre is None or rule_accomplished(pre):
-                if not rule_accomplished(post):
-                    raise RuntimeError("Rule not accomplished: %s (pre: %s)" % (post[1], pre[1]))
+            pre_ok = evaluate_rule(pre, vectorized(pre), timeline, ports)
+            post_ok = evaluate_rule(post, vectorized(post), timeline, ports, where=pre_ok)
+            failed = pre_ok & ~post_ok
+            if failed.any():
+                violations.append((pre[1] if pre else None, post[1], timeline[failed]))
 
-    def _run_test_case(self, tc_id: str, inputs: dict, outputs: dict, relations: dict = None, relations_fn:str = None, show_values: bool = True):
+        return violations
+
+    def _run_test_case(self, tc_id: str, inputs: dict, outputs: dict, relations: dict = None, relations_fn:str = None,
+                       show_values: bool = True, history: int = None, scheduler=None, t_start: int = None,
+                       t_end: int = None):
+        # With t_start the monitors have been moved to their state at t_start (see StatesMonitor.seek), and steps
+        # before it are not checked. Neither are steps after t_end.
         if inputs is None:
             raise RuntimeError("Inputs not specified.")
 
         self.inputs = inputs
         self.outputs = outputs
         self.relations = relations
+        parameters = {name: list(signature(fun).parameters) for name, fun in (relations or {}).items()}
+        self.relations_arity = {name: len(params) for name, params in parameters.items()}
+        self.relations_temporal = {name: TemporalContext() for name, params in parameters.items()
+                                   if len(params) == 3 and params[2] == "temporal"}
+        self.relations_memo = {name: MemoizedRelation(fun, fun.memo_size) for name, fun in (relations or {}).items()
+                               if getattr(fun, "memo_size", None) and self.relations_arity[name] == 2}
 
         if tc_id not in self.port_values:
-            self.port_values[tc_id] = OrderedDict()
+            spill_path = os.path.join(self.spill_dir, tc_id) if self.spill_dir is not None else None
+            kinds = {key: schema.kind for key, schema in self.port_schemas().items()}
+            self.port_values[tc_id] = TraceStore(inputs, outputs, spill_path=spill_path, max_length=history,
+                                                 kinds=kinds)
+        trace = self.port_values[tc_id]
 
         if relations_fn is not None:
             self.parse_file_relations(relations_fn)
@@ -176,45 +877,216 @@ class TestingHandler(ABC):
             self.file_relations = None
 
         self.relations_mem = dict() if relations is not None else None
+        self.relations_deps = {}
+        self.changed_ports = None
+        self.scheduler = scheduler if scheduler is not None else EventScheduler(inputs, outputs)
 
-        self.sim_time = self.get_next_event_time()
-        while self.sim_time is not None:
-            print("\nExecuting simulation time %.3f" % (self.sim_time / 1000))
-            self.execute_time()
+        if self.profiler is not None:
+            self.profiler.start_run(tc_id)
 
-            inp_values = {k: v.curr_state for k, v in inputs.items()}
-            out_values = {k: v.curr_state for k, v in outputs.items()}
-            self.port_values[tc_id][self.sim_time] = (inp_values, out_values)
+        first_step = True
+        show_values = show_values and self.verbose
+        try:
+            self.sim_time = self.get_next_event_time() if t_start is None else self.window_start_time(t_start)
+            while self.sim_time is not None and (t_end is None or self.sim_time <= t_end):
+                if self.verbose:
+                    print("\nExecuting simulation time %.3f" % (self.sim_time / 1000))
+                if first_step and self.sim_time == t_start:
+                    # Every port holds its state at t_start already
+                    changed = [("in", port) for port in inputs] + [("out", port) for port in outputs]
+                else:
+                    changed = self.execute_time()
 
-            if show_values:
-                print("Inputs:", inp_values)
-                print("Outputs:", out_values)
+                # Every relation is checked at the first step
+                if self.incremental and not first_step:
+                    self.changed_ports = set(changed)
+                first_step = False
 
-            if self.visualizer is not None:
-                self.visualizer.update(self)
-                self.visualizer.show()
+                trace.append(self.sim_time, inputs, outputs)
+                if self.profiler is not None:
+                    self.profiler.add_step(len(changed))
 
-            if relations:
-                self.check_func_relations()
+                if show_values:
+                    print("Inputs:", {k: v.curr_state for k, v in inputs.items()})
+                    print("Outputs:", {k: v.curr_state for k, v in outputs.items()})
 
-            if self.file_relations:
-                self.check_file_relations()
+                if self.visualizer is not None:
+                    self.visualizer.update(self)
+                    self.visualizer.show()
 
-            self.sim_time = self.get_next_event_time()
+                if relations:
+                    self.check_func_relations()
 
+                if self.file_relations:
+                    if self.temporal_ops:
+                        self.update_temporal_ops()
+                    self.check_file_relations()
+
+                self.sim_time = self.get_next_event_time()
+        finally:
+            trace.flush()
+            if self.visualizer is not None:
+                self.visualizer.finish()
+            if self.profiler is not None:
+                self.profiler.end_run(inputs, outputs)
 
 
 class MetamorphicTestingHandler(TestingHandler):
 
-    def __init__(self, input_filenames: dict, output_filenames: dict, visualizer: Visualizer = None, multival=False):
-        super().__init__(visualizer)
+    def __init__(self, input_filenames: dict, output_filenames: dict, visualizer: "Visualizer" = None, multival=False,
+                 spill_dir: str = None, trace_cache: bool = False, incremental: bool = False, verbose: bool = True,
+                 profile: bool = False, time_index: bool = False):
+        super().__init__(visualizer, spill_dir, incremental, verbose, profile)
         self.last_state = None
         self.input_filenames = input_filenames
         self.output_filenames = output_filenames
         self.multival = multival
+        self.trace_cache = trace_cache  # Keep the parsed port files in binary caches (see trace_cache.py)
+        self.time_index = time_index  # Keep sparse time indexes of the port files to seek into them (see time_index.py)
+
+    def open_monitors(self, input_path: str, output_path: str, monitor_class=None, **monitor_args):
+        if monitor_class is None:
+            if self.trace_cache:
+                from trace_cache import CachedStatesMonitor
+                monitor_class = CachedStatesMonitor
+            else:
+                monitor_class = StatesMonitor
+
+        def open_monitor(folder, entry):
+            filename, schema = port_file(entry)
+            return monitor_class(os.path.join(folder, filename), multival=self.multival, schema=schema,
+                                 **monitor_args)
+
+        # If a file cannot be opened, the ones opened so far are closed
+        inputs, outputs = {}, {}
+        try:
+            for k, v in self.input_filenames.items():
+                inputs[k] = open_monitor(input_path, v)
+            for k, v in self.output_filenames.items():
+                outputs[k] = open_monitor(output_path, v)
+        except BaseException:
+            close_monitors(inputs, outputs)
+            raise
+        return inputs, outputs
+
+    def run_test_case(self, tc_id: str, input_path: str, output_path: str, relations_fun: dict, relations_fn: str,
+                      t_start: int = None, t_end: int = None):
+        """Checks the relations over the port files of a test case.
+
+        With t_start and/or t_end (ms) only the steps of that window are checked: every monitor seeks to its state
+        at t_start (directly with time_index=True, once the indexes are built) before the first of them.
+        """
+        inputs, outputs = self.open_monitors(input_path, output_path, time_index=self.time_index)
+        try:
+            if t_start is not None:
+                for mon in itertools.chain(inputs.values(), outputs.values()):
+                    mon.seek(t_start)
+            try:
+                self._run_test_case(tc_id, inputs, outputs, relations_fun, relations_fn, t_start=t_start,
+                                    t_end=t_end)
+            except Exception:
+                # Failing runs also write the caches and indexes (e.g. to re-run them while fixing the relations, or
+                # to check windows around the failure), but their error is the one raised
+                try:
+                    self.complete_files(inputs, outputs)
+                except Exception:
+                    pass
+                raise
+            self.complete_files(inputs, outputs)
+        finally:
+            close_monitors(inputs, outputs)
+
+    def complete_files(self, inputs: dict, outputs: dict):
+        # Parses the rest of the port files (if the test case ended before them) so that their caches and indexes
+        # get written
+        for mon in itertools.chain(inputs.values(), outputs.values()):
+            if self.trace_cache:
+                mon.complete_cache()
+            if self.time_index:
+                mon.complete_index()
+
+    def follow_test_case(self, tc_id: str, input_path: str, output_path: str, relations_fun: dict, relations_fn: str,
+                         poll_interval: float = 0.1, timeout: float = None, is_done=None, history: int = 1000,
+                         progress=None):
+        """Checks the relations while the simulation is still writing the port files (see FollowStatesMonitor).
+
+        A violation raises as soon as it is found, so the simulation can be stopped early. The simulation must write
+        its events in time order across the files: a step is checked once a later time has been written to any
+        file, progress() (if given) returns a time at or after it, or the simulation is done (see FollowScheduler).
+        Only the last steps (at least history of them) are kept in port_values[tc_id].
+        """
+        inputs, outputs = self.open_monitors(input_path, output_path, FollowStatesMonitor, timeout=timeout,
+                                             is_done=is_done)
+        try:
+            self._run_test_case(tc_id, inputs, outputs, relations_fun, relations_fn, history=history,
+                                scheduler=FollowScheduler(inputs, outputs, poll_interval, progress))
+        finally:
+            close_monitors(inputs, outputs)
+
+    def run_test_case_stream(self, tc_id: str, batches, relations_fun: dict, relations_fn: str):
+        """Checks the relations on a time-sorted stream of batches of (port_type, port, time, state) events, e.g. a
+        SocketEventSource receiving them from a running simulator (see socket_source.py)."""
+        from socket_source import PortState, StreamScheduler
+
+        inputs = {k: PortState() for k in self.input_filenames}
+        outputs = {k: PortState() for k in self.output_filenames}
+        self._run_test_case(tc_id, inputs, outputs, relations_fun, relations_fn,
+                            scheduler=StreamScheduler(batches, inputs, outputs))
+
+    def run_test_case_multiplexed(self, tc_id: str, trace_path: str, relations_fun: dict, relations_fn: str):
+        """Checks the relations over a multiplexed trace, with the events of all the ports in a single file read
+        sequentially (see multiplexed.py, which also converts port files to this format)."""
+        from multiplexed import MultiplexedTrace
+
+        with MultiplexedTrace(trace_path, self.multival, self.port_schemas()) as trace:
+            self.run_test_case_stream(tc_id, trace, relations_fun, relations_fn)
+
+    def port_schemas(self):
+        # {(port_type, port): PortSchema} of the ports declared with a schema
+        schemas = {}
+        for port_type, filenames in (("in", self.input_filenames), ("out", self.output_filenames)):
+            for port, entry in filenames.items():
+                schema = port_file(entry)[1]
+                if schema is not None:
+                    schemas[(port_type, port)] = schema
+        return schemas
+
+    def run_test_case_batch(self, input_path: str, output_path: str, relations_fn: str):
+        """Offline check of the file relations over the whole traces (see check_file_relations_batch)."""
+        inputs, outputs = self.open_monitors(input_path, output_path)
+        try:
+            return self.check_file_relations_batch(inputs, outputs, relations_fn)
+        finally:
+            close_monitors(inputs, outputs)
+
+    def run_cross_test_cases(self, test_cases: dict, relations: dict, tolerance: int = 0, offsets: dict = None):
+        """Checks relations over several test cases {tc_id: (input_path, output_path)} at once, aligning their
+        events on simulation time with a streaming merge-join (see cross_run.py). Returns the number of steps."""
+        from cross_run import run_cross_test_cases
+        return run_cross_test_cases(self, test_cases, relations, tolerance, offsets)
+
+    def run_test_case_sharded(self, tc_id: str, input_path: str, output_path: str, relations_fun: dict = None,
+                              relations_fn: str = None, shards: int = None, workers: int = None,
+                              stateful: str = "serial"):
+        """Checks a long test case split in shards of simulation time on a process pool, and returns a ShardedReport
+        with the violations of every shard in time order (see sharded.py)."""
+        from sharded import run_test_case_sharded
+        return run_test_case_sharded(self, tc_id, input_path, output_path, relations_fun, relations_fn, shards,
+                                     workers, stateful)
+
+    def run_test_cases(self, test_cases: list, relations_fun: dict = None, relations_fn: str = None,
+                       workers: int = None, capture_output: bool = False):
+        """Runs a list of (tc_id, input_path, output_path) on a process pool and returns a merged CampaignReport.
 
-    def run_test_case(self, tc_id: str, input_path: str, output_path: str, relations_fun: dict, relations_fn: str):
-        inputs = {k: StatesMonitor(os.path.join(input_path, v), multival=self.multival) for k, v in self.input_filenames.items()}
-        outputs = {k: StatesMonitor(os.path.join(output_path, v), multival=self.multival) for k, v in self.output_filenames.items()}
+        The test cases run on handlers with the same configuration as this one, without visualizer (see
+        campaign.py). Their port values are not sent back, only violations, step counts and timings.
+        """
+        from campaign import run_test_cases
+        return run_test_cases(self.worker_config(), test_cases, relations_fun, relations_fn, workers,
+                              capture_output)
 
-        self._run_test_case(tc_id, inputs, outputs, relations_fun, relations_fn)
+    def worker_config(self):
+        return {"input_filenames": self.input_filenames, "output_filenames": self.output_filenames,
+                "multival": self.multival, "spill_dir": self.spill_dir, "trace_cache": self.trace_cache,
+                "time_index": self.time_index,
+                "incremental": self.incremental, "verbose": self.verbose}
@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+
+INDEX_DIR = ".mmpy_cache"  # Shared with the trace caches (see trace_cache.py)
+INDEX_SUFFIX = ".index.npz"
+STRIDE = 4096  # Lines between index entries
+
+
+def index_path(path):
+    folder, name = os.path.split(os.path.abspath(path))
+    return os.path.join(folder, INDEX_DIR, name + INDEX_SUFFIX)
+
+
+def source_stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class TimeIndex:
+    """Sparse index of a port file: the time and byte offset of the start of one line every stride lines, up to the
+    end of the port, and the time of its last state (None if it has none)."""
+
+    def __init__(self, times, offsets, stride=STRIDE, end_time=None):
+        self.times = np.asarray(times, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.stride = stride
+        self.end_time = end_time
+
+    def __len__(self):
+        return len(self.times)
+
+    def seek_offset(self, sim_time):
+        """Offset of the last indexed line before sim_time (0 if none): the state at sim_time is read from there.
+        Lines after the end of the port are not indexed, so the offset never skips it."""
+        i = int(np.searchsorted(self.times, sim_time, side="left")) - 1
+        return int(self.offsets[i]) if i >= 0 else 0
+
+    def save(self, source):
+        path = index_path(source)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size, mtime_ns = source_stat(source)
+        tmp_path = "%s.%d.tmp.npz" % (path[:-len(".npz")], os.getpid())
+        np.savez(tmp_path, times=self.times, offsets=self.offsets, stride=self.stride, size=size, mtime_ns=mtime_ns,
+                 end_time=-1 if self.end_time is None else self.end_time)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, source):
+        """Index of the file source, or None if it is missing or stale (the file changed since it was built)."""
+        try:
+            with np.load(index_path(source)) as data:
+                if (int(data["size"]), int(data["mtime_ns"])) != source_stat(source):
+                    return None
+                end_time = int(data["end_time"])
+                return cls(data["times"], data["offsets"], int(data["stride"]), None if end_time < 0 else end_time)
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+class TimeIndexBuilder:
+    """Builds the TimeIndex of a port file from its blocks of lines while they are parsed."""
+
+    def __init__(self, encoding, stride=STRIDE):
+        self.encoding = encoding
+        self.stride = stride
+        self.lines = 0  # Lines seen so far
+        self.offset = 0  # Bytes seen so far
+        self.times = []
+        self.offsets = []
+        self.end_time = None  # Time of the last state of the port so far
+        self.ended = False  # Whether the end of the port was reached before the end of the file
+
+    def add_block(self, text, times):
+        # text holds the lines of the block without its last line break, and times their parsed times
+        if self.ended:
+            return
+
+        # As in StatesMonitor.advance, malformed lines are skipped before the first state, and the first one after it
+        # ends the port: the lines after it are never read, so they are not indexed
+        start = 0
+        if self.end_time is None:
+            start = next((i for i, state_time in enumerate(times) if state_time is not None), len(times))
+        try:
+            end = times.index(None, start)
+            self.ended = True
+        except ValueError:
+            end = len(times)
+        if start < end:
+            self.end_time = times[end - 1]
+
+        ascii_text = text.isascii()
+        lines = text.split("\n")
+        first = -self.lines % self.stride
+        if first < end:
+            if ascii_text:
+                lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+            else:
+                lengths = np.fromiter((len(line.encode(self.encoding)) for line in lines), dtype=np.int64,
+                                      count=len(lines))
+            starts = self.offset + np.cumsum(lengths + 1) - (lengths + 1)
+            for i in range(first, end, self.stride):
+                # Malformed lines before the first state have no time
+                if times[i] is not None:
+                    self.times.append(times[i])
+                    self.offsets.append(int(starts[i]))
+
+        self.lines += len(lines)
+        self.offset += (len(text) if ascii_text else len(text.encode(self.encoding))) + 1
+
+    def build(self):
+        return TimeIndex(self.times, self.offsets, self.stride, self.end_time)
+
+
+def last_time(mon):
+    """Time of the last state of the port of a monitor that was just opened (None if it has none), where a full run
+    ends it (see StatesMonitor.advance).
+
+    It is read from the time index of the file if the monitor has one. Otherwise the rest of the file is parsed,
+    which also writes its index.
+    """
+    if mon.index is not None:
+        return mon.index.end_time
+    while mon.next_time is not None:
+        mon.advance()
+    mon.complete_index()
+    return mon.curr_time
@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from testing import StatesMonitor
+from time_index import INDEX_SUFFIX, TimeIndex
+from trace_store import TraceColumn, GrowableArray, native_states
+
+CACHE_DIR = ".mmpy_cache"
+CHUNK_SIZE = 1 << 16  # Entries decoded at once from the cache
+
+
+def cache_base(path, multival):
+    # Sidecar files are kept in a cache folder next to the port file
+    folder, name = os.path.split(os.path.abspath(path))
+    return os.path.join(folder, CACHE_DIR, "%s.%s" % (name, "mv" if multival else "sv"))
+
+
+def source_key(path, multival, schema=None):
+    stat = os.stat(path)
+    return {"source": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "multival": multival, "schema": None if schema is None else schema.spec()}
+
+
+def is_valid(header):
+    try:
+        key = source_key(header["source"], header["multival"])
+        key["schema"] = header.get("schema")  # Checked by the monitor reading the cache
+    except OSError:
+        return False
+    return all(header.get(k) == v for k, v in key.items())
+
+
+def load_header(base):
+    try:
+        with open(base + ".json", "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class CachedStatesMonitor(StatesMonitor):
+    """StatesMonitor that reads the parsed (time, state) entries of its file from a binary sidecar cache.
+
+    If the cache is missing or stale (different size, mtime, multival flag or schema), the file is parsed as
+    usual and the cache is written, so later runs only load the memory-mapped columns. The cache is complete only
+    once the whole file is parsed, see complete_cache().
+    """
+
+    def __init__(self, path, multival=False, schema=None, time_index=False):
+        self.base = cache_base(path, multival)
+        self.header = load_header(self.base)
+        key = source_key(path, multival, schema)
+        if self.header is not None and not (is_valid(self.header) and self.header.get("schema") == key["schema"]):
+            self.header = None
+        self.key = key if self.header is None else None
+        super().__init__(path, multival, schema, time_index)
+
+    def open(self, path):
+        return super().open(path) if self.header is None else None
+
+    def read_blocks(self):
+        if self.header is not None:
+            yield from self.read_cached_blocks()
+        else:
+            yield from self.record_blocks()
+
+    def read_cached_blocks(self):
+        length = self.header["length"]
+        if not length:
+            return
+
+        times = np.memmap(self.base + ".times", dtype=np.int64, mode="r", shape=(length,))
+        values = np.memmap(self.base + ".values", dtype=self.header["dtype"], mode="r", shape=(length,))
+        levels = self.header["levels"]
+
+        for start in range(0, length, CHUNK_SIZE):
+            block_times = [None if t < 0 else t for t in times[start:start + CHUNK_SIZE].tolist()]
+            block_values = values[start:start + CHUNK_SIZE].tolist()
+            if levels is None:
+                block_states = native_states(block_values, self.header.get("kind", "float"))
+            elif self.schema is not None:
+                # JSON turned records into lists
+                restore = self.schema.restore
+                block_states = [restore(levels[c]) for c in block_values]
+            else:
+                # Lists are copied, as parsing creates a new one for every line
+                block_states = [list(levels[c]) if isinstance(levels[c], list) else levels[c] for c in block_values]
+            yield block_times, block_states
+
+    def record_blocks(self):
+        os.makedirs(os.path.dirname(self.base), exist_ok=True)
+        tmp_base = "%s.%d.%d.tmp" % (self.base, os.getpid(), id(self))
+        times = GrowableArray(np.int64, CHUNK_SIZE, tmp_base + ".times")
+        values = TraceColumn(CHUNK_SIZE, tmp_base, None if self.schema is None else self.schema.kind)
+
+        try:
+            for block_times, block_states in super().read_blocks():
+                for state_time, state in zip(block_times, block_states):
+                    times.append(-1 if state_time is None else state_time)
+                    values.append(state)
+                yield block_times, block_states
+        except BaseException:
+            # Parsing failed or the monitor was discarded before the end of the file
+            for path in (times.path, values.array.path):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        times.flush()
+        values.array.flush()
+        os.replace(times.path, self.base + ".times")
+        os.replace(values.array.path, self.base + ".values")
+
+        header = dict(self.key, length=times.size, dtype=values.array.dtype.str, kind=values.kind,
+                      levels=values.levels)
+        with open(tmp_base + ".json", "w") as f:
+            json.dump(header, f)
+        os.replace(tmp_base + ".json", self.base + ".json")
+
+    def seek(self, sim_time):
+        # Jumping ahead would leave a gap in the cache being written, and cached columns are fast to scan
+        self.skip_to(sim_time)
+
+    def complete_cache(self):
+        # Parses the rest of the file (if the test case ended before it) so that its cache gets written
+        if self.header is None:
+            for _ in self.blocks:
+                pass
+
+
+def prune_caches(root):
+    """Removes the stale or orphan cache files (and time indexes) under root. Returns the paths removed."""
+    removed = []
+    for folder, dirs, files in os.walk(root):
+        if os.path.basename(folder) != CACHE_DIR:
+            continue
+
+        valid = set()
+        for name in files:
+            if name.endswith(".json"):
+                base = os.path.join(folder, name[:-len(".json")])
+                header = load_header(base)
+                if header is not None and is_valid(header):
+                    valid.add(base)
+
+        for name in files:
+            if name.endswith(INDEX_SUFFIX):
+                # Time index of a port file (see time_index.py)
+                source = os.path.join(os.path.dirname(folder), name[:-len(INDEX_SUFFIX)])
+                if os.path.exists(source) and TimeIndex.load(source) is not None:
+                    continue
+                os.remove(os.path.join(folder, name))
+                removed.append(os.path.join(folder, name))
+                continue
+
+            base = os.path.join(folder, os.path.splitext(name)[0])
+            if base not in valid:
+                os.remove(os.path.join(folder, name))
+                removed.append(os.path.join(folder, name))
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the binary caches of parsed port files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    prune_parser = subparsers.add_parser("prune", help="remove stale or orphan cache files")
+    prune_parser.add_argument("roots", nargs="+", help="folders searched recursively for caches")
+    args = parser.parse_args()
+
+    for root in args.roots:
+        for path in prune_caches(root):
+            print("Removed %s" % path)
@@ -0,0 +1,317 @@
+import itertools
+import os
+import re
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class GrowableArray:
+    """1-D NumPy buffer that grows in chunks, optionally backed by a memory-mapped file."""
+
+    def __init__(self, dtype, chunk_size=4096, path=None):
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.path = path
+        self.size = 0
+        self.data = None
+        self._allocate(chunk_size)
+
+    def _allocate(self, capacity):
+        if self.path is None:
+            data = np.empty(capacity, dtype=self.dtype)
+            if self.size:
+                data[:self.size] = self.data[:self.size]
+            self.data = data
+        else:
+            if self.data is None:
+                mode = "w+"
+            else:
+                self.data.flush()
+                self.data = None
+                with open(self.path, "r+b") as f:
+                    f.truncate(capacity * self.dtype.itemsize)
+                mode = "r+"
+            self.data = np.memmap(self.path, dtype=self.dtype, mode=mode, shape=(capacity,))
+
+    def append(self, value):
+        if self.size == len(self.data):
+            # Grow geometrically, rounded to whole chunks
+            grow = max(self.chunk_size, self.size // 2)
+            self._allocate(self.size + grow - grow % self.chunk_size)
+        self.data[self.size] = value
+        self.size += 1
+
+    def values(self):
+        return self.data[:self.size]
+
+    def drop_front(self, count):
+        self.data[:self.size - count] = self.data[count:self.size]
+        self.size -= count
+
+    def flush(self):
+        if self.path is not None:
+            self.data.flush()
+
+
+MISSING_INT = np.iinfo(np.int64).min  # None in int64 columns
+MAX_INT = np.iinfo(np.int64).max
+MISSING_BOOL = -1  # None in bool (int8) columns
+
+
+def native_states(values, kind):
+    """States of a list of raw values of a native column of the given kind ("float", "int" or "bool")."""
+    if kind == "float":
+        return [None if value != value else value for value in values]
+    elif kind == "int":
+        return [None if value == MISSING_INT else value for value in values]
+    return [None if value == MISSING_BOOL else value == 1 for value in values]
+
+
+class TraceColumn:
+    """Values of a port in a native array chosen by the kind of its schema: int64 for "int" (MISSING_INT for None),
+    int8 for "bool" (MISSING_BOOL for None) and float64 otherwise (NaN for None). Once other values appear (including
+    NaN), int32 codes into a table of levels."""
+
+    DTYPES = {"float": np.float64, "int": np.int64, "bool": np.int8}
+    MISSING = {"float": np.nan, "int": MISSING_INT, "bool": MISSING_BOOL}
+    NAN_KEY = object()  # Key of NaN in level_codes
+
+    def __init__(self, chunk_size=4096, path=None, kind=None):
+        self.chunk_size = chunk_size
+        self.path = path
+        self.kind = kind if kind in TraceColumn.DTYPES else "float"
+        self.levels = None
+        self.level_codes = None
+        dtype = np.dtype(TraceColumn.DTYPES[self.kind])
+        self.array = GrowableArray(dtype, chunk_size, self._array_path(dtype.str[1:]))
+
+    @property
+    def categorical(self):
+        return self.levels is not None
+
+    def _array_path(self, suffix):
+        return None if self.path is None else "%s.%s.mmap" % (self.path, suffix)
+
+    @staticmethod
+    def _level_key(value):
+        if isinstance(value, list):
+            return tuple(value)
+        # NaN is not equal to itself, so all NaN values share one key
+        return TraceColumn.NAN_KEY if type(value) is float and value != value else value
+
+    def _code(self, value):
+        key = self._level_key(value)
+        code = self.level_codes.get(key)
+        if code is None:
+            code = len(self.levels)
+            self.level_codes[key] = code
+            self.levels.append(value)
+        return code
+
+    def _to_categorical(self):
+        states = native_states(self.array.values().tolist(), self.kind)
+        self.levels = []
+        self.level_codes = {}
+
+        codes = GrowableArray(np.int32, self.chunk_size, self._array_path("i4"))
+        for state in states:
+            codes.append(self._code(state))
+
+        old_path = self.array.path
+        self.array = codes
+        if old_path is not None:
+            os.remove(old_path)
+
+    def encode(self, value):
+        # Value stored in the array, switching the column to categorical if it does not fit its native type
+        if self.levels is None:
+            kind = self.kind
+            if value is None:
+                return TraceColumn.MISSING[kind]
+            elif kind == "float":
+                # NaN stands for None in float columns, so NaN values (e.g. of a "float" port) go to the levels
+                if type(value) is float and value == value:
+                    return value
+            elif kind == "int":
+                if type(value) is int and MISSING_INT < value <= MAX_INT:
+                    return value
+            elif type(value) is bool:
+                return value
+
+            self._to_categorical()
+
+        return self._code(value)
+
+    def append(self, value):
+        # Encoded first: it may replace the array
+        value = self.encode(value)
+        self.array.append(value)
+
+    def set(self, index, value):
+        value = self.encode(value)
+        self.array.data[index] = value
+
+    def __getitem__(self, index):
+        value = self.array.data[index]
+        if self.levels is not None:
+            return self.levels[value]
+        elif self.kind == "float":
+            value = float(value)
+            return None if value != value else value
+        elif self.kind == "int":
+            value = int(value)
+            return None if value == MISSING_INT else value
+        return None if value == MISSING_BOOL else bool(value)
+
+    def __len__(self):
+        return self.array.size
+
+
+class TraceStore(Mapping):
+    """Columnar storage of the port values of a test case: one time array plus one typed array per port.
+
+    It behaves as a read-only dict {sim_time: (input_values, output_values)}, as the per-step dicts it replaces: the
+    values of a time that is already stored (e.g. when a test case runs again) are overwritten in place. If
+    max_length is set, the oldest steps are dropped so that only between max_length and 2 * max_length of the
+    last steps are kept. kinds ({(port_type, port): schema kind}) selects the native columns of typed ports.
+    """
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self, input_ports, output_ports, chunk_size=CHUNK_SIZE, spill_path=None, max_length=None,
+                 kinds=None):
+        self.input_ports = list(input_ports)
+        self.output_ports = list(output_ports)
+        self.chunk_size = chunk_size
+        self.spill_path = spill_path
+        self.max_length = max_length
+        self.sorted = True
+        self.positions = None  # sim_time -> index, to find times once they are not sorted
+
+        if spill_path is not None:
+            os.makedirs(os.path.dirname(spill_path) or ".", exist_ok=True)
+
+        self.times = GrowableArray(np.int64, chunk_size, self._column_path("time", "i8"))
+        kinds = kinds or {}
+        self.inputs = {port: TraceColumn(chunk_size, self._column_path("in_%s" % port), kinds.get(("in", port)))
+                       for port in self.input_ports}
+        self.outputs = {port: TraceColumn(chunk_size, self._column_path("out_%s" % port), kinds.get(("out", port)))
+                        for port in self.output_ports}
+
+    def _column_path(self, name, suffix=None):
+        if self.spill_path is None:
+            return None
+
+        path = "%s.%s" % (self.spill_path, re.sub(r"[^a-zA-Z0-9_.-]", "_", name))
+        return path if suffix is None else "%s.%s.mmap" % (path, suffix)
+
+    def append(self, sim_time, inputs, outputs):
+        size = self.times.size
+        if not self.sorted or (size and sim_time <= self.times.data[size - 1]):
+            index = self.find(sim_time)
+            if index is not None:
+                for port, column in self.inputs.items():
+                    column.set(index, inputs[port].curr_state)
+                for port, column in self.outputs.items():
+                    column.set(index, outputs[port].curr_state)
+                return
+            self.sorted = False
+
+        self.times.append(sim_time)
+        if self.positions is not None:
+            self.positions[sim_time] = size
+        for port, column in self.inputs.items():
+            column.append(inputs[port].curr_state)
+        for port, column in self.outputs.items():
+            column.append(outputs[port].curr_state)
+
+        if self.max_length is not None and self.times.size >= 2 * self.max_length:
+            self.drop_front(self.times.size - self.max_length)
+
+    def drop_front(self, count):
+        # Removes the first count steps
+        self.times.drop_front(count)
+        self.positions = None
+        for column in itertools.chain(self.inputs.values(), self.outputs.values()):
+            column.array.drop_front(count)
+
+    def flush(self):
+        self.times.flush()
+        for column in itertools.chain(self.inputs.values(), self.outputs.values()):
+            column.array.flush()
+
+    def row(self, index):
+        return ({port: column[index] for port, column in self.inputs.items()},
+                {port: column[index] for port, column in self.outputs.items()})
+
+    def find(self, sim_time):
+        # Index of the step at sim_time, or None
+        if self.sorted:
+            times = self.times.values()
+            index = int(np.searchsorted(times, sim_time))
+            return index if index < len(times) and times[index] == sim_time else None
+
+        if self.positions is None:
+            self.positions = {step_time: index for index, step_time in enumerate(self.times.values().tolist())}
+        return self.positions.get(sim_time)
+
+    def index(self, sim_time):
+        index = self.find(sim_time)
+        if index is None:
+            raise KeyError(sim_time)
+        return index
+
+    def __getitem__(self, sim_time):
+        return self.row(self.index(sim_time))
+
+    def __iter__(self):
+        return iter(self.times.values().tolist())
+
+    def __len__(self):
+        return self.times.size
+
+    def rows(self):
+        # Faster than items(): no time lookups
+        for index, sim_time in enumerate(self.times.values().tolist()):
+            yield sim_time, self.row(index)
+
+    def column(self, port_type, port):
+        # Raw column: native values (see TraceColumn) or int32 codes into column.levels
+        columns = self.inputs if port_type == "in" else self.outputs
+        return columns[port].array.values()
+
+    def to_records(self):
+        fields = [("time", np.int64)]
+        for port_type, columns in (("in", self.inputs), ("out", self.outputs)):
+            fields += [("%s:%s" % (port_type, port), column.array.dtype) for port, column in columns.items()]
+
+        records = np.empty(len(self), dtype=fields)
+        records["time"] = self.times.values()
+        for port_type, columns in (("in", self.inputs), ("out", self.outputs)):
+            for port, column in columns.items():
+                records["%s:%s" % (port_type, port)] = column.array.values()
+        return records
+
+    def save(self, path):
+        """Exports the trace to a .npz (one array per column) or a .npy (structured array) file.
+
+        Categorical columns are stored as int32 codes, and int and bool columns with their values for None (see
+        TraceColumn). In .npz files their levels are saved under
+        "<column>.levels" as object arrays (np.load(..., allow_pickle=True) is needed to read them).
+        """
+        if path.endswith(".npy"):
+            np.save(path, self.to_records())
+            return
+
+        arrays = {"time": self.times.values()}
+        for port_type, columns in (("in", self.inputs), ("out", self.outputs)):
+            for port, column in columns.items():
+                name = "%s:%s" % (port_type, port)
+                arrays[name] = column.array.values()
+                if column.categorical:
+                    levels = np.empty(len(column.levels), dtype=object)
+                    for i, level in enumerate(column.levels):
+                        levels[i] = level
+                    arrays[name + ".levels"] = levels
+        np.savez(path, **arrays)
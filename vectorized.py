@@ -0,0 +1,221 @@
+import ast
+from types import SimpleNamespace
+
+import numpy as np
+
+COMPARE_OPS = {ast.Eq: np.equal, ast.NotEq: np.not_equal, ast.Lt: np.less, ast.LtE: np.less_equal,
+               ast.Gt: np.greater, ast.GtE: np.greater_equal}
+ARITHMETIC_OPS = (ast.Add, ast.Sub, ast.Mult)  # Divisions are left out: they raise on zero step by step
+
+
+def read_monitor(mon):
+    """Drains a StatesMonitor into a list of event times and a list of states (one per distinct time)."""
+    times = []
+    states = []
+    while mon.next_time is not None:
+        mon.advance()
+        times.append(mon.curr_time)
+        states.append(mon.curr_state)
+    return times, states
+
+
+def numeric_states(states, literal=None):
+    """Float64 array of the states (NaN for None), or None if some state is not a number once interpreted with
+    literal (if given)."""
+    values = np.empty(len(states), dtype=np.float64)
+    for i, state in enumerate(states):
+        if literal is not None:
+            state = literal(state)
+        if state is None:
+            values[i] = np.nan
+        elif type(state) in (int, float, bool):
+            values[i] = state
+        else:
+            return None
+    return values
+
+
+def align_monitors(inputs, outputs, literal, typed_ports=()):
+    """Aligns the streams of all the monitors on the merged event timeline, forward-filling every port.
+
+    Returns (timeline, ports), where ports maps (port_type, port) to (states, values, missing): the raw states
+    (object array), their numeric representation (float64 array, or None if not numeric) and a mask of the steps
+    where the port state is None (including the steps before its first event). States are interpreted with literal,
+    except for the ports in typed_ports ((port_type, port)), whose states are typed already. As in TestingHandler,
+    the timeline ends once all the inputs or all the outputs are exhausted. Port files are expected to be sorted by
+    time.
+    """
+    streams = {}
+    for port_type, monitors in (("in", inputs), ("out", outputs)):
+        for port, mon in monitors.items():
+            streams[(port_type, port)] = read_monitor(mon)
+
+    # testing.py imports this module
+    from testing import simulation_end_time
+    last = simulation_end_time({port_type: [times[-1] for (p_type, _), (times, _) in streams.items()
+                                            if p_type == port_type and times] for port_type in ("in", "out")})
+    if last is None:
+        return np.empty(0, dtype=np.int64), {}
+
+    timeline = np.unique(np.concatenate([np.asarray(times, dtype=np.int64) for times, _ in streams.values()]))
+    timeline = timeline[timeline <= last]
+
+    ports = {}
+    for key, (times, states) in streams.items():
+        # Position 0 is the "no state yet" slot
+        idx = np.searchsorted(np.asarray(times, dtype=np.int64), timeline, side="right")
+
+        all_states = np.empty(len(states) + 1, dtype=object)
+        for i, state in enumerate(states, 1):
+            all_states[i] = state
+
+        values = numeric_states(states, None if key in typed_ports else literal)
+        if values is not None:
+            values = np.concatenate(([np.nan], values))[idx]
+
+        missing = np.array([True] + [state is None for state in states])[idx]
+        ports[key] = (all_states[idx], values, missing)
+    return timeline, ports
+
+
+class _Vectorizer(ast.NodeTransformer):
+    """Rewrites a rule expression into NumPy elementwise operations. Raises ValueError if it cannot."""
+
+    def __init__(self):
+        self.bool_context = [True]
+
+    def generic_visit(self, node):
+        raise ValueError("unsupported expression: %s" % type(node).__name__)
+
+    def _call(self, fun, *args):
+        return ast.Call(func=ast.Name(id=fun, ctx=ast.Load()), args=list(args), keywords=[])
+
+    def _operand(self, node):
+        # and/or/not return their operands in Python, so they are only vectorized where just truth matters
+        self.bool_context.append(False)
+        try:
+            return self.visit(node)
+        finally:
+            self.bool_context.pop()
+
+    def _boolean(self, node):
+        self.bool_context.append(True)
+        try:
+            return self.visit(node)
+        finally:
+            self.bool_context.pop()
+
+    def visit_Expression(self, node):
+        node.body = self.visit(node.body)
+        return node
+
+    def visit_BoolOp(self, node):
+        if not self.bool_context[-1]:
+            raise ValueError("and/or used as a value")
+
+        fun = "_and" if isinstance(node.op, ast.And) else "_or"
+        values = [self._boolean(value) for value in node.values]
+        result = values[0]
+        for value in values[1:]:
+            result = self._call(fun, result, value)
+        return result
+
+    def visit_UnaryOp(self, node):
+        if isinstance(node.op, ast.Not):
+            if not self.bool_context[-1]:
+                raise ValueError("not used as a value")
+            return self._call("_not", self._boolean(node.operand))
+        elif isinstance(node.op, (ast.USub, ast.UAdd)):
+            node.operand = self._operand(node.operand)
+            return node
+        raise ValueError("unsupported operator: %s" % type(node.op).__name__)
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, ARITHMETIC_OPS):
+            raise ValueError("unsupported operator: %s" % type(node.op).__name__)
+        node.left = self._operand(node.left)
+        node.right = self._operand(node.right)
+        return node
+
+    def visit_Compare(self, node):
+        operands = [self._operand(node.left)] + [self._operand(comp) for comp in node.comparators]
+        result = None
+        for op, left, right in zip(node.ops, operands, operands[1:]):
+            if type(op) not in COMPARE_OPS:
+                raise ValueError("unsupported comparison: %s" % type(op).__name__)
+            comparison = self._call("_%s" % type(op).__name__, left, right)
+            result = comparison if result is None else self._call("_and", result, comparison)
+        return result
+
+    def visit_Constant(self, node):
+        if type(node.value) not in (int, float, bool):
+            raise ValueError("unsupported constant: %r" % (node.value,))
+        return node
+
+    def visit_Subscript(self, node):
+        if isinstance(node.value, ast.Name) and node.value.id in ("inputs", "outputs") \
+                and isinstance(node.slice, ast.Constant):
+            return node
+        raise ValueError("unsupported subscript")
+
+
+def compile_vectorized_rule(expression, relations_fn="<rule>"):
+    """Compiles a rule expression (ports as inputs["name"] / outputs["name"]) into a function of two dicts of
+    port arrays returning a boolean array.
+
+    Returns None if the rule uses constructs that cannot be evaluated elementwise with the same result.
+    """
+    try:
+        tree = _Vectorizer().visit(ast.parse(expression.strip(), mode="eval"))
+    except (ValueError, SyntaxError):
+        return None
+
+    tree.body = ast.Call(func=ast.Name(id="_bool", ctx=ast.Load()), args=[tree.body], keywords=[])
+    code = compile(ast.fix_missing_locations(ast.Expression(body=ast.Lambda(
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg="inputs"), ast.arg(arg="outputs")], kwonlyargs=[],
+                           kw_defaults=[], defaults=[]),
+        body=tree.body))), relations_fn, "eval")
+
+    env = {"_and": np.logical_and, "_or": np.logical_or, "_not": np.logical_not,
+           "_bool": lambda res: np.asarray(res, dtype=bool)}
+    env.update({"_%s" % op.__name__: fun for op, fun in COMPARE_OPS.items()})
+    return eval(code, env)
+
+
+def evaluate_rule(rule, vec_fun, timeline, ports, where=None):
+    """Evaluates a parsed file rule ((in_deps, out_deps), text, step_fun) on every step of an aligned trace.
+
+    Steps are evaluated elementwise with vec_fun when possible. Steps where some port has no numeric value (e.g.
+    no state yet, or multival states) are evaluated one by one with the step function, as in the step by step
+    mode, but only where the mask "where" is set.
+    """
+    n = len(timeline)
+    if rule is None:
+        return np.ones(n, dtype=bool)
+
+    (in_deps, out_deps), text, step_fun = rule
+    deps = [("in", port) for port in in_deps] + [("out", port) for port in out_deps]
+
+    result = np.zeros(n, dtype=bool)
+    scalar_rows = np.zeros(n, dtype=bool)
+
+    if vec_fun is None or any(ports[dep][1] is None for dep in deps):
+        scalar_rows[:] = True
+    else:
+        for dep in deps:
+            scalar_rows |= ports[dep][2]
+
+        with np.errstate(all="ignore"):
+            vec_result = vec_fun({port: ports[("in", port)][1] for port in in_deps},
+                                 {port: ports[("out", port)][1] for port in out_deps})
+        result[:] = np.broadcast_to(vec_result, (n,))
+
+    if where is not None:
+        scalar_rows &= where
+
+    for row in np.flatnonzero(scalar_rows):
+        inputs = {port: SimpleNamespace(curr_state=ports[("in", port)][0][row]) for port in in_deps}
+        outputs = {port: SimpleNamespace(curr_state=ports[("out", port)][0][row]) for port in out_deps}
+        result[row] = bool(step_fun(inputs, outputs))
+
+    return result
@@ -1,13 +1,15 @@
-
+import multiprocessing
+import os
+import queue
+import traceback
 from abc import ABC, abstractmethod
-import matplotlib
-import matplotlib.patches as patches
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
+
 import numpy as np
+from matplotlib.figure import Figure
+import matplotlib.patches as patches
 from PIL import Image
 
-matplotlib.use('TkAgg')
+VIDEO_EXTENSIONS = (".mp4", ".gif")
 
 
 class Visualizer(ABC):
@@ -20,6 +22,181 @@ class Visualizer(ABC):
     def show(self):
         pass
 
+    def finish(self):
+        # Called at the end of every test case
+        pass
+
+
+class BoxesVisualizer(Visualizer):
+    """Draws a box around every port of an image (BOXES: port -> ((left, top), (right, bottom))), with a color
+    given by the state of the port (see color()).
+
+    The boxes are created once and only their colors are updated, and frames where no color changes are skipped.
+    On screen, frames are drawn with blitting and shown for pause seconds. If output is set, frames are rendered
+    offline with the Agg backend in a background process instead, to a folder of PNG files or to a video (.mp4 or
+    .gif), which is complete once finish() returns. If the renderer fails, its error is raised by the next show() or
+    finish().
+    """
+
+    BOXES = {}
+    IMAGE_PATH = None
+    LINEWIDTHS = {}  # port -> line width, if not 2
+    PAUSE = 0.5
+
+    def __init__(self, output=None, pause=None, fps=2, dpi=100):
+        self.output = output
+        self.pause = self.PAUSE if pause is None else pause
+        self.fps = fps
+        self.dpi = dpi
+
+        self.img = np.array(Image.open(self.IMAGE_PATH), dtype=np.uint8)
+        self.colors = {port: None for port in self.BOXES}
+        self.changed = False
+        self.sim_time = None
+        self.frames = 0
+
+        if output is None:
+            import matplotlib.pyplot as plt
+            self.plt = plt
+            self.fig, self.ax = plt.subplots(1)
+            self.rects = draw_boxes(self.ax, self.img, self.BOXES, self.LINEWIDTHS, animated=True)
+            plt.show(block=False)
+            self.fig.canvas.draw()
+            self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+            self.fig.canvas.mpl_connect("draw_event", self.on_draw)
+        else:
+            self.worker = None
+
+    def color(self, port_type, port, state):
+        return "r" if state == 1 else "b"
+
+    def update(self, wr):
+        self.sim_time = wr.sim_time
+        for port_type, monitors in (("in", wr.inputs), ("out", wr.outputs)):
+            for port, mon in monitors.items():
+                if port in self.BOXES:
+                    color = self.color(port_type, port, mon.curr_state)
+                    if color != self.colors[port]:
+                        self.colors[port] = color
+                        self.changed = True
+
+    def show(self):
+        if not self.changed:
+            return
+        self.changed = False
+
+        if self.output is None:
+            self.blit()
+        else:
+            if self.worker is None:
+                self.start_worker()
+            self.put_frame((self.sim_time, dict(self.colors)))
+            self.frames += 1
+
+    def on_draw(self, event):
+        # The figure was fully redrawn (e.g. resized): the background has to be copied again
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        for rect in self.rects.values():
+            self.ax.draw_artist(rect)
+
+    def blit(self):
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        for port, rect in self.rects.items():
+            rect.set_edgecolor(self.colors[port] or "none")
+            self.ax.draw_artist(rect)
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+        if self.pause:
+            canvas.start_event_loop(self.pause)
+
+    def start_worker(self):
+        self.frame_queue = multiprocessing.Queue(maxsize=64)
+        self.errors = multiprocessing.SimpleQueue()
+        self.worker = multiprocessing.Process(target=render_frames, name="mmpy-visualizer", daemon=True,
+                                              args=(self.frame_queue, self.errors, self.output, self.img, self.BOXES,
+                                                    self.LINEWIDTHS, self.fps, self.dpi))
+        self.worker.start()
+
+    def put_frame(self, frame):
+        # Waits while the queue is full, as long as the renderer is alive
+        while True:
+            if not self.worker.is_alive():
+                self.worker_failed()
+            try:
+                self.frame_queue.put(frame, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def worker_failed(self):
+        # The renderer stopped before the end of the frames: its queue is dropped and its error raised
+        self.worker.join()
+        error = self.errors.get() if not self.errors.empty() else "exit code %s" % self.worker.exitcode
+        self.frame_queue.cancel_join_thread()
+        self.worker = None
+        raise RuntimeError("The frame renderer failed: %s" % error)
+
+    def finish(self):
+        # Waits for the frames queued so far (offline mode)
+        if self.output is not None and self.worker is not None:
+            self.put_frame(None)
+            self.worker.join()
+            if not self.errors.empty() or self.worker.exitcode != 0:
+                self.worker_failed()
+            self.worker = None
+
+
+def draw_boxes(ax, img, boxes, linewidths, animated=False):
+    ax.imshow(img)
+    rects = {}
+    for port, (tl, br) in boxes.items():
+        rects[port] = patches.Rectangle(tl, br[0] - tl[0], br[1] - tl[1], linewidth=linewidths.get(port, 2),
+                                        edgecolor="none", facecolor="none", animated=animated)
+        ax.add_patch(rects[port])
+    return rects
+
+
+def render_frames(frame_queue, errors, output, img, boxes, linewidths, fps, dpi):
+    # Body of the renderer process of a BoxesVisualizer: frames are (sim_time, colors) until None, and an error is
+    # passed back as its traceback
+    try:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.set_axis_off()
+        rects = draw_boxes(ax, img, boxes, linewidths)
+        title = ax.set_title("")
+
+        writer = None
+        if output.endswith(VIDEO_EXTENSIONS):
+            from matplotlib import animation
+            writer_class = animation.PillowWriter if output.endswith(".gif") else animation.FFMpegWriter
+            writer = writer_class(fps=fps)
+            writer.setup(fig, output, dpi=dpi)
+        else:
+            os.makedirs(output, exist_ok=True)
+
+        frames = 0
+        while True:
+            frame = frame_queue.get()
+            if frame is None:
+                break
 
+            sim_time, colors = frame
+            for port, rect in rects.items():
+                rect.set_edgecolor(colors[port] or "none")
+            title.set_text("%.3f s" % (sim_time / 1000) if sim_time is not None else "")
 
+            if writer is not None:
+                writer.grab_frame()
+            else:
+                fig.savefig(os.path.join(output, "frame_%06d.png" % frames), dpi=dpi)
+            frames += 1
 
+        if writer is not None:
+            writer.finish()
+    except Exception:
+        errors.put(traceback.format_exc())